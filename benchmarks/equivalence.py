@@ -0,0 +1,368 @@
+"""Equivalence check of trapy: compares the vectorized computations with the loop semantics of the
+original implementation (one Trial at a time, one time point at a time) on the demo data and synthetic
+cohorts, for several trial durations and time resolutions, so performance work can not change results
+unnoticed:
+
+    python benchmarks/equivalence.py            # exit code 1 on a mismatch
+    python benchmarks/equivalence.py --quick    # demo data at 1 s resolution only
+
+Round trips check that txt files on disk, the metrics cache, zip archives, the dataset index, the
+command line and TRA.save()/TRA.load() (also saving a loaded experiment to its own archive) give
+the same experiment as the txt contents analyzed in memory.
+
+Reference functions (reference_*) are deliberately simple loops over the boutlist as in the first
+release of trapy (and pandas for the group statistics), generalized to other durations and resolutions; they are slow and only meant for this check.
+"""
+import io
+import os
+import sys
+import glob
+import zipfile
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trapy import TRA
+from trapy.tra import trials_to_df
+from trapy.cli import main as cli_main
+from trapy.index import DatasetIndex
+from trapy.live import LiveTrial, LiveGroup
+from trapy.store import trial_columns
+from trapy.stream import TimecourseAccumulator
+from trapy.synthetic import synthetic_contents
+
+DEMO_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'demo_data')
+RESOLUTIONS = (1, 0.5, 0.25, 0.1, 0.01)
+DURATIONS = (300, 600)
+# relative tolerance of float results; counts are compared exactly
+TOLERANCE = 1e-9
+
+
+def reference_boutlist(content, duration):
+    """Returns list of times of bouts in seconds of txt content, line by line as create_boutlist() did."""
+    boutlist = []
+    bouts_after_duration = 0
+    for line in content.decode().splitlines():
+        fields = line.split(' ')
+        if len(fields) < 5:
+            continue
+        hours = int(fields[1].replace('h', ''))
+        minutes = int(fields[2].replace('m', ''))
+        seconds = int(fields[3].replace('s', ''))
+        milliseconds = float(int(fields[4].replace('ms', '')))
+        seconds_total = hours * 3600 + minutes * 60 + seconds + milliseconds * 0.01
+        if seconds_total < duration:
+            boutlist.append(seconds_total)
+        else:
+            bouts_after_duration += 1
+    if bouts_after_duration > 0:
+        boutlist.append(duration)
+    return boutlist
+
+
+def reference_metrics(boutlist, duration):
+    """Returns dictionary of the TRA.metrics columns of one boutlist, as the functions of trial.py did."""
+    idle_time = 0
+    for i in range(0, len(boutlist) - 2):
+        inter_bout_time = boutlist[i + 1] - boutlist[i]
+        if inter_bout_time > 15:
+            idle_time += inter_bout_time
+    total_bouts = len(boutlist) - 1 if boutlist[-1] == duration else len(boutlist)
+    auc = 0
+    for i in range(1, len(boutlist)):
+        auc += (boutlist[i] - boutlist[i - 1]) * (i - 1 + i) / 2
+    return {
+        'Success': boutlist[-1] != duration,
+        'Total bouts': total_bouts,
+        'Total time': boutlist[-1],
+        'Idle time': idle_time,
+        'Bouts per minute': total_bouts / boutlist[-1] * 60,
+        'AUC (Area under the trial time course curve)': auc
+    }
+
+
+def reference_timecourse(boutlist, duration, resolution, count_sentinel=True):
+    """Returns array of cumulative bouts per time point as bout_time_curve_300() did at 1 s:
+    number of boutlist items at or before each time point, NaN after the first time point at or after
+    trial end. Without count_sentinel, a duration (300) at the end is not counted, as bout_time_curve() did.
+    Times are compared in hundredths of a second (the precision of the timer app),
+    so resolutions must be multiples of 0.01 s.
+    """
+    step = int(round(resolution * 100))
+    times = np.array([int(round(bout_time * 100)) for bout_time in boutlist])
+    end = -(-times[-1] // step)
+    if not count_sentinel and boutlist[-1] == duration:
+        times = times[:-1]
+    curve = []
+    for i in range(int(round(duration / resolution)) + 1):
+        if i <= end:
+            curve.append(np.count_nonzero(times <= i * step))
+        else:
+            curve.append(np.nan)
+    return np.array(curve, dtype=float)
+
+
+def reference_group_statistics(curves):
+    """Returns DataFrame of Mean, SD(n-1) and n per time point of a group's time courses (columns),
+    computed by pandas as timecourses_to_dfs() did.
+    """
+    df_mice = pd.DataFrame(curves)
+    return pd.DataFrame({'Mean': df_mice.mean(axis=1), 'SD(n-1)': df_mice.std(axis=1), 'n': df_mice.count(axis=1)})
+
+
+def reference_fine_curve(boutlist):
+    """Returns array of the number of bouts at or before each hundredth of a second from 0 until trial end
+    (exclusive), the step function whose area is the AUC; a duration (300) at the end is the trial end itself.
+    """
+    times = np.array([int(round(bout_time * 100)) for bout_time in boutlist])
+    grid = np.arange(times[-1])
+    return (times[None, :] <= grid[:, None]).sum(axis=1)
+
+
+def reference_step_auc(boutlist):
+    """Returns area under the cumulative bout curve from 0 until trial end by numeric integration
+    over hundredths of a second (exact for bout times of the timer app).
+    """
+    return reference_fine_curve(boutlist).sum() * 0.01
+
+
+def reference_mean_curve_auc(boutlists):
+    """Returns area under the averaged cumulative bout curve of a group's boutlists by numeric integration
+    over hundredths of a second; averaged at each time over the trials not ended yet.
+    """
+    curves = [reference_fine_curve(boutlist) for boutlist in boutlists]
+    area = 0
+    for i in range(max(len(curve) for curve in curves)):
+        running = [curve[i] for curve in curves if i < len(curve)]
+        area += sum(running) / len(running) * 0.01
+    return area
+
+
+def reference_mean_curve_auc_sd(curves, resolution):
+    """Returns the error of the area under the averaged curve of a group's time courses as plot_results() did:
+    square root of the sum over time steps of the variance of the trials' areas per time step
+    (trapezoidal rule as auc_time_curve300()), by pandas.
+    """
+    areas = dict()
+    for name, curve in curves.items():
+        areas[name] = [0.5 * (curve[i - 1] + curve[i]) * resolution for i in range(1, len(curve))]
+    return np.sqrt(np.nansum(pd.DataFrame(areas).std(axis=1) ** 2))
+
+
+def demo_contents():
+    """Returns list of (name, content) of the txt files of the demo data."""
+    contents = []
+    for path in sorted(glob.glob(os.path.join(DEMO_DATA, '*.txt'))):
+        with open(path, 'rb') as file:
+            contents.append((os.path.basename(path), file.read()))
+    return contents
+
+
+def cases(quick=False):
+    """Yields (name, list of (name, content), duration, resolution) of the data sets to check."""
+    demo = demo_contents()
+    if quick:
+        yield 'demo', demo, 300, 1
+        return
+    for resolution in RESOLUTIONS:
+        yield 'demo', demo, 300, resolution
+    for duration in DURATIONS:
+        # mice tested on several days, so time courses of one mouse have to be kept apart
+        cohort = list(synthetic_contents(groups=3, mice=6, days=2, duration=duration, seed=duration))
+        for resolution in RESOLUTIONS:
+            yield 'synthetic', cohort, duration, resolution
+
+
+def round_trip_cases(quick=False):
+    """Yields (name, list of (name, content), duration, resolution) of the data sets of check_round_trips()."""
+    yield 'demo', demo_contents(), 300, 1
+    if not quick:
+        yield 'synthetic', list(synthetic_contents(groups=3, mice=4, days=2, duration=600, seed=1)), 600, 0.1
+
+
+def compare(failures, case, what, actual, expected):
+    """Appends a description to failures if actual and expected arrays differ (NaN equal to NaN)."""
+    actual = np.asarray(actual, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    if actual.shape != expected.shape:
+        failures.append(f'{case}: {what}: shape {actual.shape} != {expected.shape}')
+    else:
+        differs = ~np.isclose(actual, expected, rtol=TOLERANCE, atol=TOLERANCE, equal_nan=True)
+        if differs.any():
+            first = tuple(int(i) for i in np.unravel_index(np.argmax(differs), differs.shape))
+            failures.append(f'{case}: {what}: {differs.sum()} of {differs.size} values differ, '
+                            f'e.g. {actual[first]} != {expected[first]} at {first}')
+
+
+def check_case(name, contents, duration, resolution):
+    """Returns list of mismatches of one data set."""
+    case = f'{name} (duration {duration} s, resolution {resolution} s)'
+    failures = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiment = TRA('.', contents=contents, duration=duration, resolution=resolution)
+    names = [str(trial_name) for trial_name in experiment.store.names]
+    boutlists = dict((trial_name, reference_boutlist(content, duration)) for trial_name, content in contents)
+
+    for i, trial_name in enumerate(names):
+        compare(failures, case, f'boutlist of {trial_name}', experiment.store.boutlist(i), boutlists[trial_name])
+    expected = [reference_metrics(boutlists[trial_name], duration) for trial_name in names]
+    for column in expected[0]:
+        compare(failures, case, f'metrics {column!r}', experiment.metrics[column],
+                [metrics[column] for metrics in expected])
+        compare(failures, case, f'metrics {column!r} of trials_to_df()', trials_to_df(experiment.trials)[column],
+                [metrics[column] for metrics in expected])
+
+    curves = dict((trial_name, reference_timecourse(boutlists[trial_name], duration, resolution))
+                  for trial_name in names)
+    compare(failures, case, 'time courses', experiment.store.timecourses(),
+            [curves[trial_name] for trial_name in names])
+    reference_curves = np.array([curves[trial_name] for trial_name in names])
+    points = np.arange(0, reference_curves.shape[1], 7)
+    compare(failures, case, 'time courses at every 7th time point', experiment.store.timecourses_at(points),
+            reference_curves[:, points])
+    steps = max(1, int(round(30 / resolution)))
+    ends = np.arange(steps, reference_curves.shape[1], steps)
+    bout_curves = np.array([reference_timecourse(boutlists[trial_name], duration, resolution, count_sentinel=False)
+                            for trial_name in names])
+    compare(failures, case, 'bout rates in 30 s bins', experiment.store.bout_rates(30)[0],
+            (bout_curves[:, ends] - bout_curves[:, ends - steps]) / (steps * resolution) * 60)
+    step_aucs = dict((trial_name, reference_step_auc(boutlists[trial_name])) for trial_name in names)
+    auc_trials, auc_groups = experiment.auc_summary()
+    compare(failures, case, 'AUC per trial', auc_trials['AUC'], [step_aucs[trial_name] for trial_name in names])
+    auc_sd = dict(zip(experiment.store.group.categories, experiment.store.mean_curve_auc_sd()))
+    accumulated = TimecourseAccumulator(duration, resolution).add_store(experiment.store).to_dfs()
+    for group in sorted(experiment.groups):
+        members = [i for i, trial_name in enumerate(names) if experiment.store.group[i] == group]
+        expected = reference_group_statistics(dict((names[i], curves[names[i]]) for i in members))
+        live = LiveGroup(len(expected))
+        for i in members:
+            trial = LiveTrial(names[i], duration, resolution)
+            for bout_time in boutlists[names[i]]:
+                trial.append(bout_time)
+                live.add_bout(trial)
+            compare(failures, case, f'AUC of live mode of {names[i]}', trial.step_auc, step_aucs[names[i]])
+        for column in expected:
+            compare(failures, case, f'{group} {column} of data', experiment.data[group][column], expected[column])
+            compare(failures, case, f'{group} {column} of streaming', accumulated[group][column], expected[column])
+            compare(failures, case, f'{group} {column} of live mode',
+                    live.statistics()[list(expected).index(column)], expected[column])
+        labels = trial_columns(experiment.data[group])
+        if len(set(labels)) != len(members):
+            failures.append(f'{case}: {group}: {len(set(labels))} time course columns of {len(members)} trials')
+        else:
+            compare(failures, case, f'{group} time courses of trials of data',
+                    experiment.data[group][labels].to_numpy().T, [curves[names[i]] for i in members])
+        compare(failures, case, f'{group} AUC of mean curve', auc_groups.at[group, 'AUC of mean curve'],
+                reference_mean_curve_auc([boutlists[names[i]] for i in members]))
+        compare(failures, case, f'{group} SD of AUC of mean curve', auc_sd[group],
+                reference_mean_curve_auc_sd(dict((names[i], curves[names[i]]) for i in members), resolution))
+        trial_aucs = pd.Series([step_aucs[names[i]] for i in members])
+        compare(failures, case, f'{group} n, Mean and SD(n-1) of AUC',
+                auc_groups.loc[group, ['n', 'Mean', 'SD(n-1)']],
+                [trial_aucs.count(), trial_aucs.mean(), trial_aucs.std()])
+    return failures
+
+
+def compare_experiments(failures, case, what, actual, expected):
+    """Appends descriptions of the differences of trials (by name), boutlists, metrics and data of two TRAs."""
+    names = [str(name) for name in expected.store.names]
+    if sorted(str(name) for name in actual.store.names) != sorted(names):
+        failures.append(f'{case}: {what}: other trials')
+        return
+    order = dict((str(name), i) for i, name in enumerate(actual.store.names))
+    indices = [order[name] for name in names]
+    for i, j in zip(indices, range(len(names))):
+        compare(failures, case, f'{what}: boutlist of {names[j]}', actual.store.boutlist(i), expected.store.boutlist(j))
+    for column in expected.metrics.columns:
+        values, expected_values = actual.metrics[column].iloc[indices], expected.metrics[column]
+        if column in ('Group', 'Mouse', 'Date'):
+            if [str(value) for value in values] != [str(value) for value in expected_values]:
+                failures.append(f'{case}: {what}: metrics {column!r} differ')
+        else:
+            compare(failures, case, f'{what}: metrics {column!r}', values, expected_values)
+    if sorted(actual.data) != sorted(expected.data):
+        failures.append(f'{case}: {what}: groups of data differ')
+        return
+    for group in expected.data:
+        if sorted(actual.data[group].columns) != sorted(expected.data[group].columns):
+            failures.append(f'{case}: {what}: columns of data of {group} differ')
+            continue
+        for column in expected.data[group].columns:
+            compare(failures, case, f'{what}: {group} {column} of data',
+                    actual.data[group][column], expected.data[group][column])
+
+
+def check_round_trips(name, contents, duration, resolution):
+    """Returns list of mismatches of experiments of the same txt contents made from files, the cache, a zip
+    archive, the dataset index, the command line and saved and loaded archives.
+    """
+    case = f'{name} (duration {duration} s, resolution {resolution} s)'
+    failures = []
+    settings = {'duration': duration, 'resolution': resolution}
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        expected = TRA(folder, contents=contents, **settings)
+        for trial_name, content in contents:
+            with open(os.path.join(folder, trial_name), 'wb') as file:
+                file.write(content)
+        compare_experiments(failures, case, 'txt files', TRA(folder, cache=True, **settings), expected)
+        compare_experiments(failures, case, 'cache', TRA(folder, cache=True, **settings), expected)
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for trial_name, content in contents:
+                zip_file.writestr(trial_name, content)
+        compare_experiments(failures, case, 'zip archive', TRA(folder, contents=archive.getvalue(), **settings),
+                            expected)
+
+        with DatasetIndex() as index:
+            index.scan(folder)
+            paths = index.query()
+        indexed = TRA(folder, paths=paths, **settings)
+        compare_experiments(failures, case, 'dataset index', indexed, expected)
+
+        path = indexed.save()
+        loaded = TRA.load(path)
+        compare_experiments(failures, case, 'loaded archive', loaded, expected)
+        loaded.save()
+        reloaded = TRA.load(path)
+        compare_experiments(failures, case, 'archive saved again from itself', reloaded, expected)
+        if reloaded.paths != paths or reloaded.sources != indexed.sources:
+            failures.append(f'{case}: archive saved again from itself: paths or sources differ')
+        reloaded.refresh()
+        compare_experiments(failures, case, 'refreshed archive', reloaded, expected)
+
+        summary_path = os.path.join(folder, 'summary.json')
+        if cli_main([folder, '--stage', 'metrics', '--force', '--summary', summary_path,
+                     '--duration', str(duration), '--resolution', str(resolution)]) != 0:
+            with open(summary_path) as file:
+                failures.append(f'{case}: command line failed: {file.read()}')
+        compare_experiments(failures, case, 'command line', TRA.load(path), expected)
+    return failures
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Checks trapy against the loop semantics of the original.')
+    parser.add_argument('--quick', action='store_true', help='only the demo data at 1 s resolution')
+    arguments = parser.parse_args(arguments)
+    failures = []
+    for name, contents, duration, resolution in cases(arguments.quick):
+        case_failures = check_case(name, contents, duration, resolution)
+        status = 'ok' if not case_failures else f'{len(case_failures)} mismatches'
+        print(f'{name:<10} duration {duration:>4} s  resolution {resolution:>5} s  {status}')
+        failures += case_failures
+    for name, contents, duration, resolution in round_trip_cases(arguments.quick):
+        case_failures = check_round_trips(name, contents, duration, resolution)
+        status = 'ok' if not case_failures else f'{len(case_failures)} mismatches'
+        print(f'{name:<10} duration {duration:>4} s  resolution {resolution:>5} s  round trips {status}')
+        failures += case_failures
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Import-time benchmark of trapy: guards against heavy dependencies creeping into the import path.
+
+Times each import statement in a fresh interpreter (--repeat times, the fastest counts) and checks
+which heavy modules it loaded; plotting (matplotlib) is only imported when a figure is made and
+scipy/scikit-learn not at all. Compares the times with the 'import' entry of benchmarks/baselines.json:
+
+    python benchmarks/import_time.py            # compare with baselines
+    python benchmarks/import_time.py --check    # exit code 1 on a regression or a forbidden import
+    python benchmarks/import_time.py --update   # store the times as new baselines
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# statement : heavy modules it must not import
+STATEMENTS = {
+    'import trapy': ('pandas', 'matplotlib', 'scipy', 'sklearn'),
+    'from trapy import TRA': ('matplotlib', 'scipy', 'sklearn'),
+    'import trapy.cli': ('matplotlib', 'scipy', 'sklearn'),
+}
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'scipy', 'sklearn')
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': [name for name in {modules!r} if name in sys.modules]}}))
+'''
+
+
+def time_import(statement):
+    """Runs statement in a fresh interpreter; returns (seconds, list of heavy modules loaded)."""
+    code = PROBE.format(statement=statement, modules=HEAVY_MODULES)
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env=environment, cwd=ROOT).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['modules']
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the import time of trapy.')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per statement; the fastest counts')
+    parser.add_argument('--check', action='store_true', help='exit with code 1 on a regression or a forbidden import')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slow-down (0.5: 50 %%)')
+    parser.add_argument('--slack', type=float, default=0.05, help='allowed absolute slow-down in seconds')
+    parser.add_argument('--update', action='store_true', help='store the times as baselines')
+    arguments = parser.parse_args(arguments)
+
+    baselines = dict()
+    if os.path.isfile(BASELINES):
+        with open(BASELINES) as file:
+            baselines = json.load(file)
+    failures = []
+    results = dict()
+    print(f'{"statement":<24} {"seconds":>10} {"baseline":>10} {"ratio":>7}  heavy modules')
+    for statement, forbidden in STATEMENTS.items():
+        runs = [time_import(statement) for _ in range(arguments.repeat)]
+        seconds = min(run[0] for run in runs)
+        modules = runs[0][1]
+        results[statement] = seconds
+        flags = []
+        baseline = baselines.get('import', dict()).get(statement)
+        if baseline is not None and seconds > baseline * (1 + arguments.tolerance) + arguments.slack:
+            flags.append('REGRESSION')
+        loaded = [name for name in forbidden if name in modules]
+        if loaded:
+            flags.append('IMPORTS ' + ', '.join(loaded))
+        if flags:
+            failures.append(statement)
+        baseline_text = '-' if baseline is None else f'{baseline:.4f}'
+        ratio_text = '-' if baseline is None else f'{seconds / baseline:.2f}'
+        print(f'{statement:<24} {seconds:>10.4f} {baseline_text:>10} {ratio_text:>7}  '
+              f'{", ".join(modules) or "-"}' + ''.join(f'  {flag}' for flag in flags))
+    if arguments.update:
+        baselines.setdefault('import', dict()).update({statement: round(seconds, 6)
+                                                       for statement, seconds in results.items()})
+        with open(BASELINES, 'w') as file:
+            json.dump(baselines, file, indent=2)
+            file.write('\n')
+        print(f'Updated baselines in {BASELINES}')
+    if failures:
+        print(f'{len(failures)} failures: ' + ', '.join(failures))
+        if arguments.check:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Benchmarks of trapy on synthetic cohorts (see trapy/synthetic.py) at several scales.
+
+Measures parsing, metrics, aggregation of time courses, AUC summary, plotting and export
+with the stage timings of TRA (see trapy/profiling.py); every stage is run --repeat times on a
+fresh TRA and its fastest time is reported. Compares the times with benchmarks/baselines.json:
+
+    python benchmarks/run.py                          # small and medium scale, compare with baselines
+    python benchmarks/run.py --scale large --check    # exit code 1 on a regression
+    python benchmarks/run.py --update                 # store the times as new baselines
+
+Baselines depend on the machine, so update them on the machine that checks for regressions.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import contextlib
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trapy import TRA
+from trapy.profiling import Profiler
+from trapy.synthetic import write_cohort
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# (groups, mice per group, days) of the synthetic cohorts
+SCALES = {
+    'small': (4, 10, 1),
+    'medium': (4, 25, 10),
+    'large': (10, 100, 10),
+}
+STAGES = ('parse', 'metrics', 'time courses', 'auc_summary', 'plot_data', 'plot_results', 'to_excel', 'save')
+# TRA stages summed up as 'parse'
+PARSE_STAGES = ('list files', 'parse', 'trials', 'store')
+
+
+def run_once(folder, stages):
+    """Analyzes folder once and runs the stages; returns dictionary of stage : seconds."""
+    profiler = Profiler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiment = TRA(folder, profiler=profiler)
+        if 'auc_summary' in stages:
+            experiment.auc_summary()
+        if 'plot_data' in stages:
+            experiment.plot_data()
+        if 'plot_results' in stages:
+            experiment.plot_results()
+        if 'to_excel' in stages:
+            experiment.to_excel()
+        if 'save' in stages:
+            experiment.save(os.path.join(folder, 'benchmark.trapy'))
+    records = profiler.stages
+    times = {'parse': sum(records[name]['seconds'] for name in PARSE_STAGES if name in records)}
+    for stage in stages:
+        if stage != 'parse':
+            times[stage] = records[stage]['seconds']
+    return {stage: times[stage] for stage in stages}
+
+
+def run_scale(scale, stages, repeat, data=None):
+    """Writes the cohort of a scale (to data/scale if given, else a temporary folder, reused if present)
+    and returns dictionary of stage : fastest seconds of repeat runs.
+    """
+    groups, mice, days = SCALES[scale]
+    temporary = data is None
+    folder = tempfile.mkdtemp(prefix=f'trapy_{scale}_') if temporary else os.path.join(data, scale)
+    try:
+        if not os.path.isdir(folder) or not any(name.endswith('.txt') for name in os.listdir(folder)):
+            write_cohort(folder, groups=groups, mice=mice, days=days, seed=0)
+        best = dict()
+        for _ in range(repeat):
+            for stage, seconds in run_once(folder, stages).items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+        return best
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def compare(results, baselines, tolerance, slack):
+    """Prints a table of the times and their baselines; returns list of (scale, stage) that regressed,
+    i.e. took longer than baseline * (1 + tolerance) + slack seconds.
+    """
+    regressions = []
+    print(f'{"scale":<8} {"stage":<14} {"seconds":>10} {"baseline":>10} {"ratio":>7}')
+    for scale, times in results.items():
+        for stage, seconds in times.items():
+            baseline = baselines.get(scale, dict()).get(stage)
+            if baseline is None:
+                print(f'{scale:<8} {stage:<14} {seconds:>10.4f} {"-":>10} {"-":>7}')
+                continue
+            regressed = seconds > baseline * (1 + tolerance) + slack
+            flag = '  REGRESSION' if regressed else ''
+            print(f'{scale:<8} {stage:<14} {seconds:>10.4f} {baseline:>10.4f} {seconds / baseline:>7.2f}{flag}')
+            if regressed:
+                regressions.append((scale, stage))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks trapy on synthetic cohorts.')
+    parser.add_argument('--scale', dest='scales', action='append', choices=SCALES,
+                        help='scale to run, repeat for several (default: small and medium)')
+    parser.add_argument('--stage', dest='stages', action='append', choices=STAGES,
+                        help='stage to time, repeat for several (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scale; the fastest counts')
+    parser.add_argument('--data', help='folder to keep the synthetic cohorts in (default: temporary)')
+    parser.add_argument('--check', action='store_true', help='exit with code 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slow-down (0.5: 50 %%)')
+    parser.add_argument('--slack', type=float, default=0.01, help='allowed absolute slow-down in seconds')
+    parser.add_argument('--update', action='store_true', help='store the times as baselines')
+    parser.add_argument('--output', help='path to write the times to as JSON')
+    arguments = parser.parse_args(arguments)
+    scales = arguments.scales or ['small', 'medium']
+    stages = tuple(stage for stage in STAGES if arguments.stages is None or stage in arguments.stages)
+
+    results = {scale: run_scale(scale, stages, arguments.repeat, arguments.data) for scale in scales}
+    baselines = dict()
+    if os.path.isfile(BASELINES):
+        with open(BASELINES) as file:
+            baselines = json.load(file)
+    regressions = compare(results, baselines, arguments.tolerance, arguments.slack)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if arguments.update:
+        for scale, times in results.items():
+            baselines.setdefault(scale, dict()).update({stage: round(seconds, 6) for stage, seconds in times.items()})
+        with open(BASELINES, 'w') as file:
+            json.dump(baselines, file, indent=2)
+            file.write('\n')
+        print(f'Updated baselines in {BASELINES}')
+    if regressions:
+        print(f'{len(regressions)} regressions: ' + ', '.join(f'{scale}/{stage}' for scale, stage in regressions))
+        if arguments.check:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,6 +19,9 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    entry_points={
+        "console_scripts": ["trapy=trapy.cli:main"],
+    },
+    python_requires='>=3.7',
     license='MIT',
 )
@@ -18,10 +18,10 @@ experiment.plot_data(seconds=100)
 # Saved time_courses_t100.png to /trapy/tests/demo_data
 
 experiment.plot_results()
-# AUC Group 1: n = 10, 14751.123214285715 ± 316.33616666025017 (SD)
-# AUC Group 2: n = 9, 11700.694444444445 ± 580.1222640701194 (SD)
-# AUC Group 3: n = 10, 11214.319246031746 ± 204.69887557751363 (SD)
-# AUC Group 4: n = 10, 10186.444444444445 ± 409.2312525401201 (SD)
+# AUC Group 1: n = 10, 14745.693436507938 ± 316.33616666025017 (SD)
+# AUC Group 2: n = 9, 11698.981944444453 ± 580.1222640701194 (SD)
+# AUC Group 3: n = 10, 11207.843103174602 ± 204.69887557751363 (SD)
+# AUC Group 4: n = 10, 10182.61077777777 ± 409.2312525401201 (SD)
 # Saved results.png to /trapy/tests/demo_data
 
 experiment.to_excel()
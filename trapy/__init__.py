@@ -1 +1,10 @@
-from .tra import TRA
\ No newline at end of file
+# TRA and its dependencies (pandas, NumPy) are imported on first access of trapy.TRA,
+# plotting (matplotlib) only when a figure is made, see benchmarks/import_time.py
+__all__ = ['TRA']
+
+
+def __getattr__(name):
+    if name == 'TRA':
+        from .tra import TRA
+        return TRA
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
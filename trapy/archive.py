@@ -0,0 +1,126 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from .store import TrialStore, time_index
+
+ARCHIVE_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def save_experiment(experiment, path):
+    """Writes boutlists, metrics and group time courses of a TRA to the directory path:
+    one binary .npy file per column (per 2D block for time courses) and a manifest.json
+    of names, source paths of the trials, categories and settings (including the specified paths of a TRA
+    made from a list of paths). Categorical columns are stored as integer codes.
+    The manifest is written last, so an interrupted save is not loaded as complete; the archive a TRA was
+    loaded from can be saved to again.
+    """
+    os.makedirs(path, exist_ok=True)
+    store = experiment.store
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'folder': experiment.folder,
+        'duration': experiment.duration,
+        'resolution': experiment.resolution,
+        'streaming': experiment.streaming,
+        'paths': experiment.paths,
+        'in_memory': experiment.in_memory,
+        'names': [str(name) for name in store.names],
+        'sources': [str(source) for source in experiment.sources],
+        'categories': dict(),
+        'metrics': [],
+        'data': [],
+        'accumulator': []
+    }
+    arrays = {'values': store.values, 'offsets': store.offsets}
+    for column in ('group', 'mouse', 'date'):
+        categorical = getattr(store, column)
+        manifest['categories'][column] = [str(category) for category in categorical.categories]
+        arrays[column] = categorical.codes.astype(np.int64)
+
+    for i, column in enumerate(experiment.metrics.columns):
+        values = experiment.metrics[column]
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            categorical = pd.Categorical(values)
+            categories = [str(category) for category in categorical.categories]
+            values = categorical.codes.astype(np.int64)
+        else:
+            categories = None
+            values = values.to_numpy()
+        manifest['metrics'].append({'column': column, 'categories': categories})
+        arrays[f'metrics_{i}'] = values
+
+    for i, (group, df_timecourse) in enumerate(experiment.data.items()):
+        manifest['data'].append({'group': str(group), 'columns': [str(column) for column in df_timecourse.columns]})
+        arrays[f'data_{i}'] = df_timecourse.to_numpy(dtype=float)
+
+    if experiment.accumulator is not None:
+        for i, (group, accumulator) in enumerate(experiment.accumulator.groups.items()):
+            manifest['accumulator'].append(str(group))
+            arrays[f'accumulator_{i}_count'] = accumulator.count
+            arrays[f'accumulator_{i}_mean'] = accumulator.mean
+            arrays[f'accumulator_{i}_m2'] = accumulator.m2
+
+    # arrays may be memory-mapped from this very archive (TRA.load(path).save(path)), so all of them are
+    # written to temporary files first and then replace the old files, whose mappings stay valid
+    temporaries = dict()
+    for name, array in arrays.items():
+        temporaries[name] = os.path.join(path, name + '.npy.tmp')
+        with open(temporaries[name], 'wb') as file:
+            np.save(file, np.ascontiguousarray(array), allow_pickle=False)
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+    for name, temporary in temporaries.items():
+        os.replace(temporary, os.path.join(path, name + '.npy'))
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def load_experiment(path, mmap=True):
+    """Reads a directory written by save_experiment(), returns dictionary of
+    manifest, store (TrialStore), metrics (DataFrame), data (dictionary of group : DataFrame)
+    and accumulator (dictionary of group : (count, mean, m2), empty if not streaming).
+    With mmap, arrays are memory-mapped read-only instead of read: loading takes about the same time
+    for any number of trials, and only the parts that are used are read from disk.
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        raise FileNotFoundError(f'No trapy archive at {path} (missing {MANIFEST_FILENAME})')
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    if manifest.get('version') != ARCHIVE_VERSION:
+        raise ValueError(f'trapy archive at {path} has version {manifest.get("version")}, '
+                         f'expected {ARCHIVE_VERSION}')
+    mmap_mode = 'r' if mmap else None
+
+    def array(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+
+    duration, resolution = manifest['duration'], manifest['resolution']
+    categories = manifest['categories']
+    columns = {column: pd.Categorical.from_codes(array(column), categories[column])
+               for column in ('group', 'mouse', 'date')}
+    store = TrialStore(array('values'), array('offsets'), manifest['names'],
+                       columns['group'], columns['mouse'], columns['date'], duration, resolution)
+
+    metrics = dict()
+    for i, column in enumerate(manifest['metrics']):
+        values = array(f'metrics_{i}')
+        if column['categories'] is not None:
+            values = np.asarray(pd.Categorical.from_codes(values, column['categories']))
+        metrics[column['column']] = values
+    metrics = pd.DataFrame(metrics)
+
+    index = time_index(duration, resolution)
+    data = dict()
+    for i, group in enumerate(manifest['data']):
+        df_timecourse = pd.DataFrame(array(f'data_{i}'), index=index, columns=group['columns'], copy=False)
+        df_timecourse['n'] = df_timecourse['n'].astype(np.int64)
+        data[group['group']] = df_timecourse
+
+    accumulator = {group: tuple(array(f'accumulator_{i}_{name}') for name in ('count', 'mean', 'm2'))
+                   for i, group in enumerate(manifest['accumulator'])}
+    return {'manifest': manifest, 'store': store, 'metrics': metrics, 'data': data, 'accumulator': accumulator}
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+from .parser import DURATION
+
+CACHE_FILENAME = '.trapy_cache.npz'
+CACHE_VERSION = 3
+
+
+class MetricsCache:
+    """Cache of boutlists per txt file, kept up to date by file signature
+    (size and modification time, optionally a hash of the content).
+    Boutlists depend on the maximal trial time (duration), so a cache only holds entries for one duration.
+    Specify the path of the cache file to persist it on disk; without path, only the file signatures
+    are kept in memory, which is enough for TRA.refresh() to tell changed files.
+    The cache file holds plain data only (see save_entries()), so loading one from a shared folder
+    can not run code, unlike a pickle.
+    Attributes:
+        .path          - path of the cache file (None: not persisted)
+        .use_hash      - whether file contents are hashed to detect changes
+        .duration      - maximal trial time in seconds the boutlists were created for
+        .entries       - dictionary of absolute path : (signature, boutlist)
+    Methods:
+        .is_current()   - returns whether the cached entry of a file is up to date
+        .get()          - returns cached boutlist of a file, None if missing or outdated
+        .put()          - stores the boutlist of a file
+        .prune()        - removes entries of deleted files
+        .save()         - writes the cache file
+    """
+
+    def __init__(self, path=None, use_hash=False, duration=DURATION):
+        self.path = path
+        self.use_hash = use_hash
+        self.duration = duration
+        self.entries = load_entries(path, use_hash, duration)
+        self.changed = False
+
+    def is_current(self, path_to_file):
+        entry = self.entries.get(os.path.abspath(path_to_file))
+        return entry is not None and entry[0] == file_signature(path_to_file, self.use_hash)
+
+    def get(self, path_to_file):
+        if not self.is_current(path_to_file):
+            return None
+        return self.entries[os.path.abspath(path_to_file)][1]
+
+    def put(self, path_to_file, boutlist):
+        if self.path is None:
+            boutlist = None
+        self.entries[os.path.abspath(path_to_file)] = (file_signature(path_to_file, self.use_hash), boutlist)
+        self.changed = True
+
+    def prune(self, folder, paths):
+        """Removes entries of files in folder that are not in paths anymore."""
+        folder = os.path.abspath(folder)
+        keep = set(os.path.abspath(path) for path in paths)
+        for path in list(self.entries):
+            if os.path.dirname(path) == folder and path not in keep:
+                del self.entries[path]
+                self.changed = True
+
+    def save(self):
+        """Writes the cache file if entries changed; the file is replaced atomically."""
+        if self.path is None or not self.changed:
+            return
+        save_entries(self.path, self.entries, self.use_hash, self.duration)
+        self.changed = False
+
+
+def save_entries(path, entries, use_hash, duration=DURATION):
+    """Writes entries to an npz file at path, replaced atomically: all boutlists concatenated ('values')
+    with the start index of each ('offsets'), and a JSON header ('header', UTF-8 bytes) of version,
+    settings, paths and file signatures.
+    """
+    paths = [path_to_file for path_to_file, (signature, boutlist) in entries.items() if boutlist is not None]
+    boutlists = [np.asarray(entries[path_to_file][1], dtype=float) for path_to_file in paths]
+    offsets = np.zeros(len(boutlists) + 1, dtype=np.int64)
+    np.cumsum([len(boutlist) for boutlist in boutlists], out=offsets[1:])
+    values = np.concatenate(boutlists) if boutlists else np.empty(0)
+    header = {'version': CACHE_VERSION, 'use_hash': use_hash, 'duration': duration, 'paths': paths,
+              'signatures': [list(entries[path_to_file][0]) for path_to_file in paths]}
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        np.savez(file, values=values, offsets=offsets,
+                 header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8))
+    os.replace(temporary, path)
+
+
+def load_entries(path, use_hash, duration=DURATION):
+    """Returns the entries of the cache file at path (see save_entries());
+    empty if missing, unreadable or incompatible. Arrays are loaded without allow_pickle.
+    """
+    if path is None or not os.path.isfile(path):
+        return dict()
+    try:
+        with np.load(path, allow_pickle=False) as content:
+            header = json.loads(content['header'].tobytes().decode())
+            values = content['values']
+            offsets = content['offsets']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return dict()
+    if not isinstance(header, dict) or header.get('version') != CACHE_VERSION \
+            or header.get('use_hash') != use_hash or header.get('duration') != duration \
+            or len(offsets) != len(header.get('paths', ())) + 1:
+        return dict()
+    return {path_to_file: (tuple(signature), values[start:stop])
+            for path_to_file, signature, start, stop
+            in zip(header['paths'], header['signatures'], offsets[:-1], offsets[1:])}
+
+
+def file_signature(path_to_file, use_hash=False):
+    """Returns (size, modification time in ns) of a file; (size, digest of its content) if use_hash."""
+    stat = os.stat(path_to_file)
+    if not use_hash:
+        return stat.st_size, stat.st_mtime_ns
+    with open(path_to_file, 'rb') as file:
+        digest = hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+    return stat.st_size, digest
+
+
+def fingerprint(*parts):
+    """Returns hex digest of data: arrays (by dtype, shape and content) and other values (by repr)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(repr((part.dtype.str, part.shape)).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def cache_for(folder, cache, duration=DURATION):
+    """Returns the MetricsCache to use for TRA(folder, cache=...):
+    in memory for False/None, in folder for True, at the specified path for a str
+    or the specified MetricsCache object itself.
+    """
+    if isinstance(cache, MetricsCache):
+        if cache.duration != duration:
+            raise ValueError(f'MetricsCache is made for a duration of {cache.duration} s, not {duration} s')
+        return cache
+    if cache is None or cache is False:
+        return MetricsCache(duration=duration)
+    if cache is True:
+        return MetricsCache(os.path.join(folder, CACHE_FILENAME), duration=duration)
+    return MetricsCache(str(cache), duration=duration)
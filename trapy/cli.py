@@ -0,0 +1,177 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from .parser import DURATION
+from .cache import file_signature, fingerprint
+from .tra import TRA, txt_file_path_list, ARCHIVE_FILENAME
+from .archive import MANIFEST_FILENAME
+from .trial import is_trial_file
+
+STAMP_FILENAME = '.trapy_batch.json'
+# stages in the order they run; 'metrics' saves the binary archive of metrics and time courses
+STAGES = ('metrics', 'plots', 'excel')
+# seconds of the additional, shorter time course figure of the plots stage
+SHORT_SECONDS = 100
+
+
+def stage_outputs(stages, duration=DURATION):
+    """Returns list of the output file names (relative to the folder) of the specified stages."""
+    outputs = []
+    if 'metrics' in stages:
+        outputs.append(os.path.join(ARCHIVE_FILENAME, MANIFEST_FILENAME))
+    if 'plots' in stages:
+        outputs += [f'time_courses_t{duration}.png', 'results.png']
+        if SHORT_SECONDS < duration:
+            outputs.append(f'time_courses_t{SHORT_SECONDS}.png')
+    if 'excel' in stages:
+        outputs.append('TapeResponseAssay.xlsx')
+    return outputs
+
+
+def input_fingerprint(folder, stages, duration=DURATION, resolution=1):
+    """Returns fingerprint of the txt files of a folder (names, sizes, modification times) and the settings."""
+    paths = txt_file_path_list(folder)
+    return fingerprint(sorted(stages), duration, resolution,
+                       [(os.path.basename(path), file_signature(path)) for path in paths])
+
+
+def is_up_to_date(folder, digest, outputs):
+    """Returns whether the last run in folder was made from the same inputs and settings and all outputs exist."""
+    try:
+        with open(os.path.join(folder, STAMP_FILENAME)) as file:
+            stamp = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return stamp.get('fingerprint') == digest \
+        and all(os.path.isfile(os.path.join(folder, output)) for output in outputs)
+
+
+def process_folder(folder, stages=STAGES, workers=None, cache=False, duration=DURATION, resolution=1,
+                   force=False, quiet=True):
+    """Runs the specified stages for one experiment folder; worker function of main().
+    Returns dictionary of folder, status ('done', 'up to date' or 'failed'), number of trials and groups,
+    timings per stage in seconds, profile (calls and seconds per stage of the TRA, see Profiler),
+    outputs and error (traceback if failed).
+    """
+    summary = {'folder': folder, 'status': 'done', 'trials': None, 'groups': None,
+               'timings': dict(), 'profile': dict(), 'outputs': [], 'error': None}
+    start = time.perf_counter()
+    output = io.StringIO() if quiet else sys.stdout
+    try:
+        with contextlib.redirect_stdout(output):
+            outputs = stage_outputs(stages, duration)
+            digest = input_fingerprint(folder, stages, duration, resolution)
+            if not force and is_up_to_date(folder, digest, outputs):
+                summary['status'] = 'up to date'
+                summary['outputs'] = outputs
+                return summary
+            checkpoint = time.perf_counter()
+            experiment = TRA(folder, workers=workers, cache=cache, duration=duration, resolution=resolution)
+            summary['timings']['analyze'] = time.perf_counter() - checkpoint
+            summary['trials'] = len(experiment.trials)
+            summary['groups'] = sorted(experiment.groups)
+            for stage in STAGES:
+                if stage not in stages:
+                    continue
+                checkpoint = time.perf_counter()
+                if stage == 'metrics':
+                    experiment.save()
+                elif stage == 'plots':
+                    experiment.plot_data()
+                    if SHORT_SECONDS < duration:
+                        experiment.plot_data(seconds=SHORT_SECONDS)
+                    experiment.plot_results()
+                elif stage == 'excel':
+                    experiment.to_excel()
+                summary['timings'][stage] = time.perf_counter() - checkpoint
+            summary['outputs'] = outputs
+            summary['profile'] = {name: {'calls': record['calls'], 'seconds': record['seconds']}
+                                  for name, record in experiment.profiler.stages.items()}
+            with open(os.path.join(folder, STAMP_FILENAME), 'w') as file:
+                json.dump({'fingerprint': digest, 'stages': sorted(stages)}, file)
+    except Exception:
+        summary['status'] = 'failed'
+        summary['error'] = traceback.format_exc()
+    finally:
+        summary['timings']['total'] = time.perf_counter() - start
+    return summary
+
+
+def find_folders(folders, recursive=False):
+    """Returns sorted list of the folders (with recursive, also their subfolders) that contain txt files."""
+    found = set()
+    for folder in folders:
+        if not recursive:
+            found.add(folder)
+            continue
+        for root, dirs, files in os.walk(folder):
+            if any(is_trial_file(filename) for filename in files):
+                found.add(root)
+    return sorted(found)
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(
+        prog='trapy',
+        description='Analyzes tape response assay experiments: one folder of timer app txt files per experiment.')
+    parser.add_argument('folders', nargs='+', help='experiment folders')
+    parser.add_argument('-s', '--stage', dest='stages', action='append', choices=STAGES,
+                        help='stage to run, repeat for several (default: all). metrics: analyze and save '
+                             f'metrics and time courses to {ARCHIVE_FILENAME}; plots: png figures; '
+                             'excel: TapeResponseAssay.xlsx')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='process all subfolders that contain txt files')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of folders processed in parallel')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of processes analyzing the txt files of a folder')
+    parser.add_argument('--cache', action='store_true', help='cache the analysis of txt files in each folder')
+    parser.add_argument('--duration', type=float, default=DURATION, help='maximal trial time in seconds')
+    parser.add_argument('--resolution', type=float, default=1, help='time between time points in seconds')
+    parser.add_argument('-f', '--force', action='store_true', help='process folders even if outputs are up to date')
+    parser.add_argument('--summary', default='-', help='path of the JSON summary (default: - for stdout)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the analysis')
+    arguments = parser.parse_args(arguments)
+    if arguments.duration == int(arguments.duration):
+        arguments.duration = int(arguments.duration)
+    if arguments.resolution == int(arguments.resolution):
+        arguments.resolution = int(arguments.resolution)
+    return arguments
+
+
+def main(arguments=None):
+    """Entry point of the trapy command; returns exit code 1 if any folder failed, 0 otherwise."""
+    arguments = parse_arguments(arguments)
+    stages = tuple(arguments.stages or STAGES)
+    folders = find_folders(arguments.folders, arguments.recursive)
+    options = (stages, arguments.workers, arguments.cache, arguments.duration, arguments.resolution,
+               arguments.force, not arguments.verbose)
+    start = time.perf_counter()
+    if arguments.jobs > 1 and len(folders) > 1:
+        with ProcessPoolExecutor(max_workers=arguments.jobs) as executor:
+            summaries = list(executor.map(process_folder, folders, *[[option] * len(folders) for option in options]))
+    else:
+        summaries = [process_folder(folder, *options) for folder in folders]
+    summary = {
+        'stages': list(stages),
+        'folders': summaries,
+        'done': sum(folder['status'] == 'done' for folder in summaries),
+        'up to date': sum(folder['status'] == 'up to date' for folder in summaries),
+        'failed': sum(folder['status'] == 'failed' for folder in summaries),
+        'seconds': time.perf_counter() - start
+    }
+    text = json.dumps(summary, indent=2)
+    if arguments.summary == '-':
+        sys.stdout.write(text + '\n')
+    else:
+        with open(arguments.summary, 'w') as file:
+            file.write(text + '\n')
+    for folder in summaries:
+        if folder['status'] == 'failed':
+            sys.stderr.write(f'Failed: {folder["folder"]}\n{folder["error"]}')
+    return 1 if summary['failed'] else 0
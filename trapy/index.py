@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import pandas as pd
+from .trial import parse_trial_name, is_trial_file
+from .cache import file_signature
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS trials (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mouse TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trials_grp ON trials (grp, date);
+CREATE INDEX IF NOT EXISTS trials_date ON trials (date);
+CREATE INDEX IF NOT EXISTS trials_mouse ON trials (mouse);
+CREATE INDEX IF NOT EXISTS trials_folder ON trials (folder);
+'''
+
+
+class DatasetIndex:
+    """Persistent index of the txt files of many experiment folders and the metadata in their names
+    ("yymmddaa*g.txt": date, mouse, group), kept in an SQLite database. Folders are scanned recursively;
+    queries resolve to a list of file paths before any file is read, e.g. to analyze only a subset:
+        index = DatasetIndex('trials.sqlite')
+        index.scan('/data/experiment_1', '/data/experiment_2')
+        experiment = TRA('/data/results', paths=index.query(groups=['WT'], dates=('200601', '200630')))
+    Without path, the index is kept in memory only.
+    Attributes:
+        .path          - path of the database file (':memory:' if not persisted)
+        .connection    - sqlite3 connection
+    Methods:
+        .scan()         - (re-)indexes all txt files below folders, returns number of new or changed files
+        .query()        - returns sorted list of paths of the trials matching group, date, mouse and folder
+        .metadata()     - returns DataFrame of the indexed (matching) trials
+        .close()        - closes the database
+    """
+
+    def __init__(self, path=None):
+        self.path = ':memory:' if path is None else str(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM trials').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def scan(self, *folders):
+        """Walks the folders recursively and indexes the txt files found; files already indexed are
+        only updated if size or modification time changed, files that are gone are removed.
+        Returns number of new or changed files.
+        """
+        changed = 0
+        with self.connection:
+            for folder in folders:
+                folder = os.path.abspath(folder)
+                indexed = dict(((path, (size, mtime_ns)) for path, size, mtime_ns in self.connection.execute(
+                    "SELECT path, size, mtime_ns FROM trials WHERE folder = ? OR folder LIKE ? ESCAPE '\\'",
+                    (folder, like_prefix(folder)))))
+                rows = []
+                for root, dirs, files in os.walk(folder):
+                    dirs.sort()
+                    for filename in sorted(files):
+                        if not is_trial_file(filename):
+                            continue
+                        path_to_file = os.path.join(root, filename)
+                        signature = file_signature(path_to_file)
+                        if indexed.pop(path_to_file, None) == signature:
+                            continue
+                        trial_name, date, mouse, group = parse_trial_name(path_to_file)
+                        rows.append((path_to_file, root, trial_name, date, mouse, group) + signature)
+                self.connection.executemany('INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.connection.executemany('DELETE FROM trials WHERE path = ?', [(path,) for path in indexed])
+                changed += len(rows)
+        return changed
+
+    def where(self, groups=None, dates=None, mice=None, folders=None):
+        """Returns (SQL WHERE clause, parameters) of the query() arguments."""
+        clauses, parameters = [], []
+        for column, values in (('grp', groups), ('mouse', mice)):
+            if values is not None:
+                values = [values] if isinstance(values, str) else list(values)
+                clauses.append(f'{column} IN ({", ".join("?" * len(values))})')
+                parameters += values
+        if dates is not None:
+            if isinstance(dates, tuple):
+                start, end = dates
+                if start is not None:
+                    clauses.append('date >= ?')
+                    parameters.append(start)
+                if end is not None:
+                    clauses.append('date <= ?')
+                    parameters.append(end)
+            else:
+                dates = [dates] if isinstance(dates, str) else list(dates)
+                clauses.append(f'date IN ({", ".join("?" * len(dates))})')
+                parameters += dates
+        if folders is not None:
+            folders = [folders] if isinstance(folders, str) else list(folders)
+            folder_clauses = []
+            for folder in folders:
+                folder = os.path.abspath(folder)
+                folder_clauses.append("(folder = ? OR folder LIKE ? ESCAPE '\\')")
+                parameters += [folder, like_prefix(folder)]
+            clauses.append('(' + ' OR '.join(folder_clauses) + ')')
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', parameters
+
+    def query(self, groups=None, dates=None, mice=None, folders=None):
+        """Returns sorted list of paths of the indexed trials of the specified groups and mice
+        (a name or a list of names each), dates (a date yymmdd, a list of dates or an inclusive
+        (start, end) range, either of which can be None) and folders (including subfolders).
+        Arguments left at None do not restrict the query.
+        """
+        where, parameters = self.where(groups, dates, mice, folders)
+        return [path for path, in self.connection.execute(f'SELECT path FROM trials{where} ORDER BY path',
+                                                           parameters)]
+
+    def metadata(self, groups=None, dates=None, mice=None, folders=None):
+        """Returns DataFrame of Path, Folder, Name, Date, Mouse and Group of the trials matching query()."""
+        where, parameters = self.where(groups, dates, mice, folders)
+        rows = self.connection.execute(f'SELECT path, folder, name, date, mouse, grp FROM trials{where} '
+                                       f'ORDER BY path', parameters).fetchall()
+        return pd.DataFrame(rows, columns=['Path', 'Folder', 'Name', 'Date', 'Mouse', 'Group'])
+
+
+def like_prefix(folder):
+    """Returns SQL LIKE pattern of all subfolders of folder, with LIKE wildcards in folder escaped."""
+    escaped = folder.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + os.sep.replace('\\', '\\\\') + '%'
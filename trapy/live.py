@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import ntpath
+import numpy as np
+import pandas as pd
+from .parser import parse_times, TIMESTAMP, DURATION
+from .timecourse import grid_positions, n_time_points
+from .store import TrialStore, time_index
+from .cache import file_signature
+from .trial import parse_trial_name, is_trial_file
+
+# default idle threshold in seconds, see trial.idle_time()
+IDLE_THRESHOLD = 15
+
+
+class LiveTrial:
+    """A trial whose txt file is still being written by the timer app. Bouts are appended one at a time
+    and every metric is updated from the new bout only (O(1) per bout); the boutlist follows the
+    rules of create_boutlist(): from duration (300 s) on, a single duration ends the trial.
+    Attributes:
+        .path_to_file  - path of the txt file
+        .trial_name, .date, .mouse, .group - as in Trial()
+        .boutlist      - list of times of bouts in seconds so far
+        .positions     - list of the time point (see timecourse.time_grid()) each boutlist item is counted from
+        .idle_time, .auc, .step_auc - running metrics, see trial.idle_time(), trial.area_under_the_curve()
+                         and TrialStore.step_auc()
+        .offset        - number of bytes of the file read so far
+    """
+
+    def __init__(self, path_to_file, duration=DURATION, resolution=1, idle_threshold=IDLE_THRESHOLD):
+        self.path_to_file = path_to_file
+        self.trial_name, self.date, self.mouse, self.group = parse_trial_name(path_to_file)
+        self.duration = duration
+        self.resolution = resolution
+        self.idle_threshold = idle_threshold
+        self.boutlist = []
+        self.positions = []
+        self.idle_time = 0
+        self.auc = 0
+        self.sum_of_times = 0
+        self.offset = 0
+        self.pending = b''
+
+    def __len__(self):
+        return len(self.boutlist)
+
+    @property
+    def timed_out(self):
+        return len(self.boutlist) > 0 and self.boutlist[-1] == self.duration
+
+    def append(self, bout_time):
+        """Appends one time stamp in seconds; returns whether the boutlist changed
+        (not after trial time-out). A time stamp from duration on is appended as duration.
+        """
+        if self.timed_out:
+            return False
+        bout_time = min(float(bout_time), self.duration)
+        if self.boutlist:
+            # the formerly last interval is not the last one anymore, see trial.idle_time()
+            if len(self.boutlist) >= 2:
+                interval = self.boutlist[-1] - self.boutlist[-2]
+                if interval > self.idle_threshold:
+                    self.idle_time += interval
+            self.auc += (bout_time - self.boutlist[-1]) * (len(self.boutlist) - 0.5)
+        self.boutlist.append(bout_time)
+        self.positions.append(int(grid_positions([bout_time], self.duration, self.resolution)[0]))
+        self.sum_of_times += bout_time
+        return True
+
+    @property
+    def total_time(self):
+        return self.boutlist[-1]
+
+    @property
+    def success(self):
+        return not self.timed_out
+
+    @property
+    def total_bouts(self):
+        return len(self.boutlist) - self.timed_out
+
+    @property
+    def bouts_per_minute(self):
+        return self.total_bouts / self.total_time * 60 if self.total_time > 0 else np.nan
+
+    @property
+    def step_auc(self):
+        return len(self.boutlist) * self.total_time - self.sum_of_times
+
+    def timecourse300(self):
+        """Returns array of cumulative bouts per time point as Trial.timecourse300, NaN after trial end;
+        computed from the positions of the bouts on request.
+        """
+        n_points = n_time_points(self.duration, self.resolution)
+        curve = np.cumsum(np.bincount(self.positions, minlength=n_points + 1)[:-1]).astype(float)
+        end = self.positions[-1] if self.positions else -1
+        curve[end + 1:] = np.nan
+        return curve
+
+
+class LiveGroup:
+    """Running group time course statistics of LiveTrials, kept as differences between consecutive
+    time points of n, sum and sum of squares of the cumulative bout counts (cf. timecourse.group_statistics()).
+    A new bout changes a constant number of entries; statistics are summed up on request.
+    """
+
+    def __init__(self, n_points):
+        self.n_points = n_points
+        self.n = np.zeros(n_points + 1, dtype=np.int64)
+        self.sums = np.zeros(n_points + 1, dtype=np.int64)
+        self.squares = np.zeros(n_points + 1, dtype=np.int64)
+
+    def end_contribution(self, final, end, sign):
+        """Adds (sign 1) or removes (sign -1) the drop of a trial's final count and of the trial itself
+        after the time point of its end.
+        """
+        after_end = min(end + 1, self.n_points)
+        self.n[after_end] -= sign
+        self.sums[after_end] -= sign * final
+        self.squares[after_end] -= sign * final ** 2
+
+    def add_bout(self, trial):
+        """Folds the last bout of the trial into the statistics; call after LiveTrial.append()."""
+        rank = len(trial.boutlist)
+        if rank == 1:
+            self.n[0] += 1
+        else:
+            self.end_contribution(rank - 1, trial.positions[-2], -1)
+        position = trial.positions[-1]
+        self.sums[position] += 1
+        self.squares[position] += 2 * rank - 1
+        self.end_contribution(rank, position, 1)
+
+    def remove_trial(self, trial):
+        """Removes all contributions of a trial, e.g. of a deleted or rewritten file."""
+        if not trial.boutlist:
+            return
+        self.n[0] -= 1
+        for rank, position in enumerate(trial.positions, 1):
+            self.sums[position] -= 1
+            self.squares[position] -= 2 * rank - 1
+        self.end_contribution(len(trial.positions), trial.positions[-1], -1)
+
+    def statistics(self):
+        """Returns (mean, SD(n-1), n) per time point, as timecourse.group_statistics()."""
+        n, sums, squares = (np.cumsum(diffs)[:-1] for diffs in (self.n, self.sums, self.squares))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / n
+            sd = np.sqrt((n * squares - sums ** 2) / (n * (n - 1)))
+        sd[n < 2] = np.nan
+        return mean, sd, n
+
+
+class LiveSession:
+    """Live acquisition mode: watches a folder of txt files written by the timer app during an assay session.
+    Every poll reads only the bytes appended to each file since the last one (and new files),
+    appends the new bouts to their LiveTrial and updates the trial's metrics and its group's
+    time course statistics incrementally, without recomputing other trials.
+    A last line without line break is read once the file has stopped growing for one poll, up to the end
+    of its last complete time stamp; the rest is kept until more bytes arrive.
+    Files that shrink (e.g. rewritten) are read again from the start; trials of deleted files are dropped.
+    Attributes:
+        .folder        - watched path
+        .duration      - maximal trial time in seconds (300)
+        .resolution    - time between time points of time courses in seconds (1)
+        .trials        - dictionary of path : LiveTrial
+        .groups        - dictionary of group : LiveGroup
+    Methods:
+        .poll()         - reads new lines and files once, returns list of paths of changed trials
+        .watch()        - polls repeatedly and calls back with the changes
+        .metrics()      - returns DataFrame of metrics per trial, as TRA.metrics
+        .data()         - returns dictionary of group : DataFrame of Mean, SD(n-1) and n per time point
+        .store()        - returns TrialStore of the trials so far, e.g. for the full analysis of TRA
+    """
+
+    def __init__(self, folder, duration=DURATION, resolution=1, idle_threshold=IDLE_THRESHOLD):
+        self.folder = folder
+        self.duration = duration
+        self.resolution = resolution
+        self.idle_threshold = idle_threshold
+        self.trials = dict()
+        self.groups = dict()
+        self.signatures = dict()
+
+    def group(self, group):
+        if group not in self.groups:
+            self.groups[group] = LiveGroup(n_time_points(self.duration, self.resolution))
+        return self.groups[group]
+
+    def poll(self):
+        paths = sorted(os.path.join(self.folder, entry.name) for entry in os.scandir(self.folder)
+                       if entry.is_file() and is_trial_file(entry.name))
+        changed = []
+        for path_to_file in set(self.trials) - set(paths):
+            self.group(self.trials[path_to_file].group).remove_trial(self.trials.pop(path_to_file))
+            self.signatures.pop(path_to_file, None)
+            changed.append(path_to_file)
+        for path_to_file in paths:
+            if self.read(path_to_file):
+                changed.append(path_to_file)
+        return changed
+
+    def read(self, path_to_file):
+        """Reads the bytes appended to a file since the last poll; returns whether its trial changed."""
+        try:
+            signature = file_signature(path_to_file)
+        except OSError:
+            return False
+        size = signature[0]
+        trial = self.trials.get(path_to_file)
+        if trial is None or size < trial.offset + len(trial.pending):
+            if trial is not None:
+                self.group(trial.group).remove_trial(trial)
+            trial = LiveTrial(path_to_file, self.duration, self.resolution, self.idle_threshold)
+            self.trials[path_to_file] = trial
+        grown = signature != self.signatures.get(path_to_file)
+        self.signatures[path_to_file] = signature
+        if grown:
+            with open(path_to_file, 'rb') as file:
+                file.seek(trial.offset + len(trial.pending))
+                content = trial.pending + file.read(size - trial.offset - len(trial.pending))
+            complete = content.rfind(b'\n') + 1
+        else:
+            # file did not grow since the last poll: time stamps of the last line are read, too,
+            # but only complete ones, the rest of the line may still be written
+            content = trial.pending
+            complete = 0
+            for match in TIMESTAMP.finditer(content):
+                complete = match.end()
+        trial.offset += complete
+        trial.pending = content[complete:]
+        changed = False
+        for bout_time in parse_times(content[:complete]):
+            if trial.append(bout_time):
+                self.group(trial.group).add_bout(trial)
+                changed = True
+        return changed
+
+    def watch(self, interval=1, callback=None, polls=None):
+        """Polls the folder every interval seconds, polls times (None: until interrupted).
+        After a poll with changes, calls callback(session, changed paths), by default printing the changes.
+        """
+        if callback is None:
+            callback = print_changes
+        count = 0
+        try:
+            while polls is None or count < polls:
+                changed = self.poll()
+                if changed:
+                    callback(self, changed)
+                count += 1
+                if polls is None or count < polls:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        return self
+
+    def live_trials(self):
+        """Returns list of LiveTrials with at least one time stamp, sorted by path."""
+        return [self.trials[path_to_file] for path_to_file in sorted(self.trials) if self.trials[path_to_file].boutlist]
+
+    def metrics(self):
+        trials = self.live_trials()
+        return pd.DataFrame({
+            'Group': [trial.group for trial in trials],
+            'Mouse': [trial.mouse for trial in trials],
+            'Date': [trial.date for trial in trials],
+            'Success': np.array([trial.success for trial in trials], dtype=bool),
+            'Total bouts': np.array([trial.total_bouts for trial in trials], dtype=np.int64),
+            'Total time': np.array([trial.total_time for trial in trials], dtype=float),
+            'Idle time': np.array([trial.idle_time for trial in trials], dtype=float),
+            'Bouts per minute': np.array([trial.bouts_per_minute for trial in trials], dtype=float),
+            'AUC (Area under the trial time course curve)': np.array([trial.auc for trial in trials], dtype=float)
+        })
+
+    def data(self):
+        index = time_index(self.duration, self.resolution)
+        tc_groups = dict()
+        for group in sorted(self.groups):
+            mean, sd, n = self.groups[group].statistics()
+            if n.any():
+                tc_groups[group] = pd.DataFrame({'Mean': mean, 'SD(n-1)': sd, 'n': n}, index=index)
+        return tc_groups
+
+    def store(self):
+        return TrialStore.from_trials(self.live_trials(), self.duration, self.resolution)
+
+
+def print_changes(session, changed):
+    """Default callback of LiveSession.watch(): prints the running metrics of the changed trials."""
+    for path_to_file in changed:
+        trial = session.trials.get(path_to_file)
+        if trial is None:
+            sys.stdout.write(f'{ntpath.basename(path_to_file)}: removed\n')
+        elif trial.boutlist:
+            sys.stdout.write(f'{trial.trial_name}: {trial.total_bouts} bouts in {trial.total_time:.2f} s, '
+                             f'idle time {trial.idle_time:.2f} s, AUC {trial.auc:.2f}'
+                             f'{"" if trial.success else ", timed out"}\n')
@@ -0,0 +1,85 @@
+import re
+import warnings
+import itertools
+import numpy as np
+
+# maximal trial time in seconds; bouts from then on are not relevant for statistics
+DURATION = 300
+# one time stamp of the timer app, e.g. '1. 0h 0m 9s 44ms count : 0'
+TIMESTAMP = re.compile(rb'(\d+)h\s+(\d+)m\s+(\d+)s\s+(\d+)ms')
+
+
+def parse_boutlists(contents, duration=DURATION):
+    """Takes list of raw txt file contents (bytes) of the timer app,
+    returns list of arrays of times of bouts in seconds; one array per content.
+    All contents are converted in one vectorized pass. Like create_boutlist(),
+    bouts at or after duration (300 s) are dropped and duration is appended instead.
+    """
+    values, offsets = parse_ragged(contents, duration)
+    return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def parse_ragged(contents, duration=DURATION):
+    """Takes list of raw txt file contents (bytes) of the timer app,
+    returns (values, offsets): all bout times concatenated into one array and the
+    start index of each content's bouts in it, with offsets[-1] == len(values).
+    """
+    matches = [TIMESTAMP.findall(content) for content in contents]
+    counts = np.array([len(match) for match in matches], dtype=np.int64)
+    seconds = timestamps_to_seconds(list(itertools.chain.from_iterable(matches)))
+
+    # bouts after (5 minute) trial time are not relevant for statistics,
+    # a single duration (300) in the end signifies that mouse didn't get tape off in time
+    file_index = np.repeat(np.arange(len(contents)), counts)
+    in_time = seconds < duration
+    kept = np.bincount(file_index[in_time], minlength=len(contents))
+    timed_out = np.bincount(file_index[~in_time], minlength=len(contents)) > 0
+
+    offsets = np.zeros(len(contents) + 1, dtype=np.int64)
+    np.cumsum(kept + timed_out, out=offsets[1:])
+    values = np.empty(offsets[-1], dtype=np.float64)
+    values[offsets[1:][timed_out] - 1] = duration
+    is_bout = np.ones(offsets[-1], dtype=bool)
+    is_bout[offsets[1:][timed_out] - 1] = False
+    values[is_bout] = seconds[in_time]
+    return values, offsets
+
+
+def parse_times(content):
+    """Takes raw txt (bytes) of the timer app, e.g. lines appended to a file,
+    returns array of all its time stamps in seconds, without regard to duration.
+    """
+    return timestamps_to_seconds(TIMESTAMP.findall(content))
+
+
+def timestamps_to_seconds(matches):
+    """Takes list of (h, m, s, ms) byte string tuples matched by TIMESTAMP, returns array of seconds."""
+    fields = np.array(matches, dtype='S').astype(np.int64).reshape(-1, 4)
+    # milliseconds are given as 1 second / 100 by the timer app
+    return (fields[:, 0] * 3600 + fields[:, 1] * 60 + fields[:, 2]) + fields[:, 3] * 0.01
+
+
+def drop_empty(names, boutlists):
+    """Takes names (e.g. paths) and boutlists of txt files, returns (names, boutlists) of those with
+    at least one time stamp. Files without any (empty, or just created by the timer app) are no trials;
+    they are dropped with a warning naming them.
+    """
+    kept_names, kept_boutlists = [], []
+    for name, boutlist in zip(names, boutlists):
+        if len(boutlist) == 0:
+            warnings.warn(f'Skipped {name}: no time stamps of the timer app', stacklevel=2)
+            continue
+        kept_names.append(name)
+        kept_boutlists.append(boutlist)
+    return kept_names, kept_boutlists
+
+
+def read_boutlists(paths, duration=DURATION):
+    """Takes list of paths to txt files of the timer app,
+    returns list of arrays of times of bouts in seconds; see parse_boutlists().
+    """
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            contents.append(file.read())
+    return parse_boutlists(contents, duration)
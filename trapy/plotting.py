@@ -0,0 +1,109 @@
+import os
+import json
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib import rcParams
+from .cache import fingerprint
+
+FIGURES_FILENAME = '.trapy_figures.json'
+# bump to re-render figures saved by an older version of the plotting code
+FIGURES_VERSION = 1
+# more lines than this per panel are drawn without legend
+LEGEND_MAX = 20
+
+
+def new_figure(nrows=1, ncols=1, figsize=(12, 6)):
+    """Returns (figure, axes) rendered by the non-interactive Agg canvas, without pyplot:
+    figures are not registered with a GUI backend and are freed when no longer referenced,
+    so this works headless and in worker processes.
+    """
+    fig = Figure(figsize=figsize)
+    axes = fig.subplots(nrows, ncols, squeeze=False)
+    return fig, axes
+
+
+def line_colors(n):
+    """Returns list of n colors of the property cycle, repeated as needed."""
+    colors = rcParams['axes.prop_cycle'].by_key()['color']
+    return [colors[i % len(colors)] for i in range(n)]
+
+
+def add_timecourses(ax, x, curves, labels=()):
+    """Draws 2D array of curves (curves x time points) over x as one LineCollection;
+    NaN at the end of a curve (after trial end) is left out. With up to LEGEND_MAX labels, adds a legend.
+    """
+    curves = np.asarray(curves, dtype=float)
+    x = np.asarray(x, dtype=float)
+    lengths = (~np.isnan(curves)).sum(axis=1) if curves.size else np.zeros(len(curves), dtype=int)
+    segments = [np.column_stack((x[:length], curve[:length])) for curve, length in zip(curves, lengths)]
+    colors = line_colors(len(segments))
+    ax.add_collection(LineCollection(segments, colors=colors))
+    ax.autoscale_view()
+    if 0 < len(labels) <= LEGEND_MAX:
+        ax.legend([Line2D([], [], color=color) for color in colors], labels, loc='upper left')
+
+
+def add_group_metric(ax, values, codes, groups, colors, title, ylabel, alpha=0.7, capsize=10):
+    """Draws values per trial (group code per trial) as one jittered scatter over bars of mean ± SEM per group."""
+    values = np.asarray(values, dtype=float)
+    codes = np.asarray(codes)
+    n = np.bincount(codes, minlength=len(groups))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=len(groups)) / n
+        sd = np.sqrt(np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=len(groups)) / (n - 1))
+        sem = sd / np.sqrt(n)
+    x_jitter = np.random.normal(codes, 0.09)
+    ax.scatter(x_jitter, values, c=[colors[code] for code in codes], alpha=alpha)
+    ax.bar(np.arange(len(groups)), mean, yerr=sem, color=colors[:len(groups)], capsize=capsize, alpha=alpha)
+    ax.set(xticks=np.arange(len(groups)), xticklabels=groups, title=title, ylabel=ylabel)
+
+
+def render_group_panel(path, group, x, curves, mice, mean, sd, errorevery=1):
+    """Saves the figure of one group to path: time courses per mouse | mean ± SD.
+    Worker function of TRA.plot_groups(); takes plain arrays only, so it can run in another process.
+    """
+    fig, axes = new_figure(1, 2, figsize=(12, 4))
+    add_timecourses(axes[0, 0], x, curves, mice)
+    axes[0, 0].set(title=f'Time courses per mouse in {group}',
+                   xlabel='Trial time (s)',
+                   ylabel='Cumulative bouts')
+    axes[0, 1].errorbar(x, mean, yerr=sd, errorevery=errorevery)
+    axes[0, 1].legend((group,), loc='upper left')
+    axes[0, 1].set(title='Averaged time course curve ± SD',
+                   xlabel='Trial time (s)',
+                   ylabel='Cumulative bouts')
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def figure_fingerprint(*parts):
+    """Returns fingerprint() of the plotted data and the version of the plotting code."""
+    return fingerprint(FIGURES_VERSION, *parts)
+
+
+def load_fingerprints(folder):
+    """Returns dictionary of figure file name : fingerprint of the figures saved in folder; empty if none."""
+    try:
+        with open(os.path.join(folder, FIGURES_FILENAME)) as file:
+            fingerprints = json.load(file)
+    except (OSError, ValueError):
+        return dict()
+    return fingerprints if isinstance(fingerprints, dict) else dict()
+
+
+def is_unchanged(folder, figname, digest):
+    """Returns whether the figure file exists in folder and was saved from data of the same fingerprint."""
+    return os.path.isfile(os.path.join(folder, figname)) and load_fingerprints(folder).get(figname) == digest
+
+
+def record_fingerprints(folder, digests):
+    """Stores dictionary of figure file name : fingerprint of figures saved in folder."""
+    fingerprints = load_fingerprints(folder)
+    fingerprints.update(digests)
+    temporary = os.path.join(folder, FIGURES_FILENAME + '.tmp')
+    with open(temporary, 'w') as file:
+        json.dump(fingerprints, file)
+    os.replace(temporary, os.path.join(folder, FIGURES_FILENAME))
@@ -0,0 +1,126 @@
+import time
+import pstats
+import cProfile
+import functools
+import contextlib
+import tracemalloc
+import pandas as pd
+
+
+class Profiler:
+    """Records wall time, number of calls and, with memory=True (Python 3.9 or later), peak memory allocated
+    (tracemalloc) per named stage of a TRA run; stages can be nested, a nested stage's time also counts for
+    the outer one.
+    With profile=True, all top-level stages are captured by cProfile as well (see .print_profile()).
+    Hooks are called after every stage with (stage name, seconds, peak memory in bytes or None),
+    e.g. to log stages or to fail a benchmark on a regression.
+    Attributes:
+        .memory        - whether peak memory is traced (slows down allocation-heavy stages)
+        .profile       - whether stages are captured by cProfile
+        .hooks         - list of callables called after every stage
+        .stages        - dictionary of stage name : dictionary of calls, seconds and peak (bytes or None)
+        .profiler      - cProfile.Profile of the captured stages (None without profile)
+    Methods:
+        .stage()        - context manager recording one call of a stage
+        .add_hook()     - adds a hook
+        .report()       - returns DataFrame of calls, seconds and peak memory per stage
+        .print_profile() - prints the cProfile statistics of the captured stages
+        .reset()        - forgets all records
+    """
+
+    def __init__(self, memory=False, profile=False, hooks=()):
+        if memory and not hasattr(tracemalloc, 'reset_peak'):
+            # peaks of nested stages are told apart by tracemalloc.reset_peak(), new in Python 3.9
+            raise ValueError('Profiler(memory=True) requires Python 3.9 or later; use memory=False')
+        self.memory = memory
+        self.profile = profile
+        self.hooks = list(hooks)
+        self.stages = dict()
+        self.profiler = cProfile.Profile() if profile else None
+        self.running = []
+        self.started_tracing = False
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def reset(self):
+        self.stages = dict()
+        self.profiler = cProfile.Profile() if self.profile else None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Records one call of the stage name while the with-block runs."""
+        outermost = not self.running
+        if self.memory:
+            if outermost and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            elif outermost:
+                self.started_tracing = False
+            if self.running:
+                # the peak of the outer stage so far is kept before the peak is reset for this one
+                self.running[-1] = max(self.running[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.running.append(0)
+        if outermost and self.profiler is not None:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if outermost and self.profiler is not None:
+                self.profiler.disable()
+            peak = self.running.pop()
+            if self.memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self.running:
+                    self.running[-1] = max(self.running[-1], peak)
+                    tracemalloc.reset_peak()
+                elif self.started_tracing:
+                    tracemalloc.stop()
+            else:
+                peak = None
+            record = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak': None})
+            record['calls'] += 1
+            record['seconds'] += seconds
+            if peak is not None:
+                record['peak'] = peak if record['peak'] is None else max(record['peak'], peak)
+            for hook in self.hooks:
+                hook(name, seconds, peak)
+
+    def report(self):
+        """Returns DataFrame of Calls, Seconds (total), Seconds per call and Peak memory (MB) per stage,
+        in order of first call.
+        """
+        return pd.DataFrame({
+            'Calls': [record['calls'] for record in self.stages.values()],
+            'Seconds': [record['seconds'] for record in self.stages.values()],
+            'Seconds per call': [record['seconds'] / record['calls'] for record in self.stages.values()],
+            'Peak memory (MB)': [None if record['peak'] is None else record['peak'] / 2 ** 20
+                                 for record in self.stages.values()]
+        }, index=pd.Index(list(self.stages), name='Stage'))
+
+    def print_profile(self, sort='cumulative', limit=30):
+        """Prints the cProfile statistics of the captured stages, sorted and limited as pstats.Stats.print_stats()."""
+        if self.profiler is None:
+            raise ValueError('Profiler was made without profile=True')
+        pstats.Stats(self.profiler).sort_stats(sort).print_stats(limit)
+
+
+def stage(profiler, name):
+    """Returns profiler.stage(name), or a context manager that does nothing if profiler is None."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+def profiled(name):
+    """Decorator of TRA methods: records every call as stage name of the instance's profiler."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with stage(getattr(self, 'profiler', None), name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
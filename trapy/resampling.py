@@ -0,0 +1,214 @@
+import itertools
+import warnings
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .store import matrix_group_statistics
+
+# elements of the largest array of one chunk of resamples (resamples x trials or resamples x variables)
+CHUNK_ELEMENTS = 2 ** 20
+# relative tolerance of permuted differences counted as large as the observed one (rounding of the sums)
+TOLERANCE = 1e-9
+
+
+def chunk_sizes(resamples, n_trials, n_variables, chunk=None):
+    """Returns list of the number of resamples per chunk: chunk each (the last one the rest),
+    by default as many as keep each array of a chunk within CHUNK_ELEMENTS.
+    """
+    if chunk is None:
+        chunk = max(1, CHUNK_ELEMENTS // max(n_trials, n_variables, 1))
+    full, rest = divmod(resamples, chunk)
+    return [chunk] * full + ([rest] if rest else [])
+
+
+def weighted_means(weights, values, valid):
+    """Takes 2D array of weights (resamples x trials), values with NaN set to 0 and valid (1 if not NaN)
+    (trials x variables), returns 2D array (resamples x variables) of the weighted means, ignoring NaN.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (weights @ values) / (weights @ valid)
+
+
+def bootstrap_chunk(values, valid, size, seed):
+    """Returns 2D array (size x variables) of the means of size bootstrap resamples of the trials (rows).
+    Each resample is drawn as one row of an index array and counted into a row of weights,
+    so the means of all resamples are one matrix product.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    draws = rng.integers(0, n, size=(size, n))
+    draws += np.arange(size)[:, None] * n
+    counts = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(float)
+    return weighted_means(counts, values, valid)
+
+
+def permutation_chunk(values, valid, n_first, observed, size, seed):
+    """Returns number of size random relabelings of the trials (rows), n_first trials labeled as
+    the first group, whose absolute difference of means (second - first group) per variable
+    is at least as large as the absolute observed difference. The first group of each relabeling is
+    the n_first smallest of random keys (argpartition, no full sort); sums of the second group
+    are the totals minus those of the first, so all relabelings take one matrix product.
+    """
+    rng = np.random.default_rng(seed)
+    n, n_variables = values.shape
+    first = np.zeros((size, n))
+    if 0 < n_first < n:
+        chosen = np.argpartition(rng.random((size, n)), n_first - 1, axis=1)[:, :n_first]
+        np.put_along_axis(first, chosen, 1, axis=1)
+    both = np.hstack([values, valid])
+    sums = first @ both
+    totals = both.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_first = sums[:, :n_variables] / sums[:, n_variables:]
+        mean_second = (totals[:n_variables] - sums[:, :n_variables]) / (totals[n_variables:] - sums[:, n_variables:])
+    threshold = np.abs(observed) * (1 - TOLERANCE)
+    return (np.abs(mean_second - mean_first) >= threshold).sum(axis=0)
+
+
+def seed_sequence(seed=None):
+    """Returns numpy SeedSequence of seed (int, None for fresh entropy, or a SeedSequence itself)."""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def run_batch(function, arguments, sizes, seeds):
+    """Returns list of function(*arguments, size, seed) per chunk; worker function of run_chunks()."""
+    return [function(*arguments, size, seed) for size, seed in zip(sizes, seeds)]
+
+
+def run_chunks(function, arguments, sizes, seeds, workers=None, executor=None):
+    """Returns list of function(*arguments, size, seed) per chunk of size resamples, in order.
+    With workers > 1, the chunks are split into one batch per worker process, so the arguments (the data)
+    are sent to each process once, not once per chunk; batches run in executor if given
+    (e.g. one ProcessPoolExecutor shared by all groups and pairs, see resampling_statistics()),
+    else in a new pool of workers processes.
+    """
+    if workers is None or workers < 2 or len(sizes) < 2:
+        return run_batch(function, arguments, sizes, seeds)
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return run_chunks(function, arguments, sizes, seeds, workers, executor)
+    bounds = np.linspace(0, len(sizes), min(workers, len(sizes)) + 1).round().astype(int)
+    futures = [executor.submit(run_batch, function, arguments, sizes[start:stop], seeds[start:stop])
+               for start, stop in zip(bounds[:-1], bounds[1:])]
+    return list(itertools.chain.from_iterable(future.result() for future in futures))
+
+
+def split_nan(matrix):
+    """Returns (matrix with NaN set to 0, 1 where matrix is not NaN, else 0) as float arrays."""
+    matrix = np.asarray(matrix, dtype=float)
+    valid = ~np.isnan(matrix)
+    return np.where(valid, matrix, 0), valid.astype(float)
+
+
+def bootstrap_means(matrix, resamples=10000, seed=None, workers=None, chunk=None, executor=None):
+    """Takes 2D array (trials x variables), returns 2D array (resamples x variables) of the means of
+    bootstrap resamples of the trials, ignoring NaN. Resamples are drawn in chunks (see chunk_sizes()),
+    each from its own child of the seed, so the same seed (and chunk) gives the same means,
+    whether chunks run serially or in workers processes (see run_chunks()).
+    """
+    values, valid = split_nan(matrix)
+    sizes = chunk_sizes(resamples, len(values), values.shape[1], chunk)
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    means = run_chunks(bootstrap_chunk, (values, valid), sizes, seeds, workers, executor)
+    return np.concatenate(means) if means else np.empty((0, values.shape[1]))
+
+
+def permutation_test(first, second, resamples=10000, seed=None, workers=None, chunk=None, executor=None):
+    """Takes 2D arrays (trials x variables) of two groups, returns (difference of means (second - first),
+    two-sided p-value per variable) of a permutation test of the group labels, ignoring NaN.
+    p-values are (1 + permutations at least as extreme) / (1 + resamples), so never 0.
+    Chunks and seeds as in bootstrap_means().
+    """
+    values, valid = split_nan(np.concatenate([first, second]))
+    n_first = len(first)
+    observed = (weighted_means(np.r_[np.zeros(n_first), np.ones(len(second))][None], values, valid)
+                - weighted_means(np.r_[np.ones(n_first), np.zeros(len(second))][None], values, valid))[0]
+    sizes = chunk_sizes(resamples, len(values), values.shape[1], chunk)
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    counts = run_chunks(permutation_chunk, (values, valid, n_first, observed), sizes, seeds, workers, executor)
+    extreme = np.sum(counts, axis=0) if counts else np.zeros(values.shape[1])
+    p_values = (1 + extreme) / (1 + resamples)
+    p_values[np.isnan(observed)] = np.nan
+    return observed, p_values
+
+
+def percentile_interval(distribution, confidence=0.95):
+    """Returns (lower, upper) percentile bounds per column of 2D array (resamples x variables), ignoring NaN."""
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # columns without any valid resample are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(distribution, [alpha, 1 - alpha], axis=0)
+
+
+def resampling_statistics(matrix, codes, groups, labels, resamples=10000, confidence=0.95, control=None,
+                          seed=0, workers=None, chunk=None):
+    """Takes 2D array (trials x variables), group code per trial, group names (by code) and DataFrame of
+    labels of the variables (one row per column of matrix, e.g. Metric, or Variable and Time (s)),
+    returns two tidy DataFrames of bootstrap and permutation statistics, ignoring NaN:
+    - per variable and group: n, Mean, and the percentile bootstrap confidence interval of the mean (CI low/high)
+    - per variable and pair of groups (every pair, or every group against control): n of both groups,
+      Difference of means (Group B - Group A), its bootstrap confidence interval from the resampled means
+      of both groups, Cohen's d (pooled SD(n-1)) and the two-sided permutation p-value
+    Each group and pair gets its own child of the seed, see bootstrap_means() and permutation_test().
+    With workers > 1, one pool of that many processes runs the resamples of all groups and pairs.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    codes = np.asarray(codes)
+    groups = list(groups)
+    mean, sd, n = matrix_group_statistics(matrix, codes, len(groups))
+    present = [code for code in range(len(groups)) if (codes == code).any()]
+    if control is None:
+        pairs = list(itertools.combinations(present, 2))
+    else:
+        if control not in groups or groups.index(control) not in present:
+            raise ValueError(f'Control group {control!r} has no trials')
+        control_code = groups.index(control)
+        pairs = [(control_code, code) for code in present if code != control_code]
+    bootstrap_sequence, permutation_sequence = seed_sequence(seed).spawn(2)
+    bootstrap_seeds = dict(zip(present, bootstrap_sequence.spawn(len(present))))
+    permutation_seeds = permutation_sequence.spawn(len(pairs))
+
+    labels = pd.DataFrame(labels).reset_index(drop=True)
+    parallel = workers is not None and workers > 1
+    with ProcessPoolExecutor(max_workers=workers) if parallel else contextlib.nullcontext() as executor:
+        distributions = {code: bootstrap_means(matrix[codes == code], resamples, bootstrap_seeds[code],
+                                               workers, chunk, executor)
+                         for code in present}
+        tests = [permutation_test(matrix[codes == first], matrix[codes == second], resamples, pair_seed,
+                                  workers, chunk, executor)
+                 for (first, second), pair_seed in zip(pairs, permutation_seeds)]
+    rows_groups = []
+    for code in present:
+        low, high = percentile_interval(distributions[code], confidence)
+        rows_groups.append(pd.DataFrame({'Group': groups[code], 'n': n[code], 'Mean': mean[code],
+                                         'CI low': low, 'CI high': high}))
+    rows_pairs = []
+    for (first, second), (difference, p_values) in zip(pairs, tests):
+        low, high = percentile_interval(distributions[second] - distributions[first], confidence)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pooled = np.sqrt(((n[first] - 1) * sd[first] ** 2 + (n[second] - 1) * sd[second] ** 2)
+                             / (n[first] + n[second] - 2))
+            cohens_d = difference / pooled
+        rows_pairs.append(pd.DataFrame({'Group A': groups[first], 'Group B': groups[second],
+                                        'n A': n[first], 'n B': n[second], 'Difference': difference,
+                                        'CI low': low, 'CI high': high, "Cohen's d": cohens_d,
+                                        'p-value': p_values}))
+    df_groups = tidy(labels, rows_groups, ['Group', 'n', 'Mean', 'CI low', 'CI high'])
+    df_pairs = tidy(labels, rows_pairs, ['Group A', 'Group B', 'n A', 'n B', 'Difference',
+                                         'CI low', 'CI high', "Cohen's d", 'p-value'])
+    return df_groups, df_pairs
+
+
+def tidy(labels, frames, columns):
+    """Returns DataFrame of the frames (one row per variable each) preceded by the variable labels,
+    one row per variable and frame, ordered by variable.
+    """
+    if not frames:
+        return pd.DataFrame(columns=list(labels.columns) + columns)
+    df = pd.concat([pd.concat([labels, frame], axis=1) for frame in frames], ignore_index=True)
+    order = np.tile(np.arange(len(labels)), len(frames)).argsort(kind='stable')
+    return df.iloc[order].reset_index(drop=True)
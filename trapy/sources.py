@@ -0,0 +1,101 @@
+import io
+import os
+import tarfile
+import zipfile
+from .parser import parse_boutlists, drop_empty, DURATION
+from .trial import Trial, is_trial_file
+
+# number of txt contents parsed at once by trials_from_contents()
+CHUNK_FILES = 256
+
+
+def iter_contents(source):
+    """Yields (name, content as bytes) of the txt files of the timer app in a source, one at a time:
+    - path to a zip or tar (also compressed) archive, or an open ZipFile / TarFile
+    - archive as bytes or as binary file-like object (e.g. an upload); tar archives are read as a stream
+    - iterable of (name, content) pairs, content as bytes, str or file-like object
+    Archive members are read without extracting them to disk; only members whose names end with '.txt'
+    are yielded, named "archive path/member name" for archives on disk, member name otherwise.
+    Metadata are parsed from the names' last part as for files on disk, see trial.parse_trial_name().
+    """
+    if isinstance(source, zipfile.ZipFile):
+        yield from iter_zip(source, source.filename)
+    elif isinstance(source, tarfile.TarFile):
+        yield from iter_tar(source, source.name)
+    elif isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                yield from iter_zip(archive, path)
+        elif tarfile.is_tarfile(path):
+            with tarfile.open(path, mode='r:*') as archive:
+                yield from iter_tar(archive, path)
+        else:
+            raise ValueError(f'{path} is neither a zip nor a tar archive')
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield from iter_contents(io.BytesIO(source))
+    elif hasattr(source, 'read'):
+        if source.seekable() and zipfile.is_zipfile(source):
+            source.seek(0)
+            with zipfile.ZipFile(source) as archive:
+                yield from iter_zip(archive)
+        else:
+            if source.seekable():
+                source.seek(0)
+            with tarfile.open(fileobj=source, mode='r|*') as archive:
+                yield from iter_tar(archive)
+    else:
+        for name, content in source:
+            yield str(name), read_content(content)
+
+
+def iter_zip(archive, prefix=None):
+    """Yields (name, content) of the txt members of an open ZipFile, see iter_contents()."""
+    for member in archive.infolist():
+        if not member.is_dir() and is_trial_file(member.filename):
+            yield member_name(prefix, member.filename), archive.read(member)
+
+
+def iter_tar(archive, prefix=None):
+    """Yields (name, content) of the txt members of an open TarFile (also opened as stream), see iter_contents()."""
+    for member in archive:
+        if member.isfile() and is_trial_file(member.name):
+            with archive.extractfile(member) as file:
+                yield member_name(prefix, member.name), file.read()
+
+
+def member_name(prefix, name):
+    return name if prefix is None else os.path.join(os.fspath(prefix), name)
+
+
+def read_content(content):
+    """Returns bytes of a txt content given as bytes, str or file-like object."""
+    if hasattr(content, 'read'):
+        content = content.read()
+    if isinstance(content, str):
+        content = content.encode()
+    return bytes(content)
+
+
+def trials_from_contents(source, duration=DURATION, resolution=1):
+    """Returns list of Trial() objects of the txt files in a source (see iter_contents()), in order of their names.
+    Contents are parsed in chunks of CHUNK_FILES, so only one chunk of raw contents is held at a time.
+    """
+    trials, names, contents = [], [], []
+    for name, content in iter_contents(source):
+        names.append(name)
+        contents.append(content)
+        if len(contents) == CHUNK_FILES:
+            trials += make_trials(names, contents, duration, resolution)
+            names, contents = [], []
+    trials += make_trials(names, contents, duration, resolution)
+    trials.sort(key=lambda trial: trial.path_to_file)
+    return trials
+
+
+def make_trials(names, contents, duration=DURATION, resolution=1):
+    """Returns list of Trial() objects of names and raw txt contents; contents without time stamps
+    are skipped with a warning.
+    """
+    return [Trial(name, boutlist, duration=duration, resolution=resolution)
+            for name, boutlist in zip(*drop_empty(names, parse_boutlists(contents, duration)))]
@@ -0,0 +1,333 @@
+import pandas as pd
+import numpy as np
+from .parser import DURATION
+from .timecourse import timecourse_matrix, timecourse_points, group_statistics, time_grid, n_time_points, counted_bouts, CHUNK_CELLS
+
+
+class TrialStore:
+    """Columnar store of the trials of an experiment: all boutlists as one ragged array
+    (values + offsets) plus categorical group, mouse and date columns.
+    Per-trial metrics and per-group time course statistics are computed vectorized over all trials.
+    Attributes:
+        .values        - times of bouts in seconds of all trials, concatenated
+        .offsets       - start index of each trial's boutlist in values; offsets[-1] == len(values)
+        .names         - array of trial (file) names
+        .group         - Categorical of groups per trial
+        .mouse         - Categorical of mouse numbers per trial
+        .date          - Categorical of dates per trial
+        .duration      - maximal trial time in seconds
+        .resolution    - time between time points of time courses in seconds
+    """
+
+    def __init__(self, values, offsets, names, group, mouse, date, duration=DURATION, resolution=1):
+        self.values = np.asarray(values, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        empty = np.flatnonzero(np.diff(self.offsets) == 0)
+        if len(empty):
+            # metrics read the last bout of every trial, an empty boutlist would take another trial's
+            raise ValueError('Trials without time stamps: ' + ', '.join(map(str, self.names[empty])))
+        self.group = pd.Categorical(group)
+        self.mouse = pd.Categorical(mouse)
+        self.date = pd.Categorical(date)
+        self.duration = duration
+        self.resolution = resolution
+
+    @classmethod
+    def from_trials(cls, trials, duration=DURATION, resolution=1):
+        """Returns TrialStore of a list of Trial() objects."""
+        lengths = [len(trial.boutlist) for trial in trials]
+        offsets = np.zeros(len(trials) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.concatenate([trial.boutlist for trial in trials]) if trials else np.empty(0)
+        return cls(values, offsets, [trial.trial_name for trial in trials],
+                   [trial.group for trial in trials], [trial.mouse for trial in trials],
+                   [trial.date for trial in trials], duration, resolution)
+
+    def subset(self, indices):
+        """Returns TrialStore of the trials at the specified indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        items = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TrialStore(self.values[items], offsets, self.names[indices], self.group[indices],
+                          self.mouse[indices], self.date[indices], self.duration, self.resolution)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        """Returns array of boutlist lengths per trial."""
+        return np.diff(self.offsets)
+
+    def trial_index(self):
+        """Returns array of the trial index of every item in values."""
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def positions(self):
+        """Returns array of the position of every item in values within its trial's boutlist."""
+        return np.arange(len(self.values)) - np.repeat(self.offsets[:-1], self.lengths())
+
+    def boutlist(self, i):
+        """Returns boutlist of the i-th trial (a view into values)."""
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def total_time(self):
+        """Returns array of the last boutlist item per trial, i.e. total trial time, see trial.total_time()."""
+        return self.values[self.offsets[1:] - 1]
+
+    def success(self):
+        """Returns bool array of whether the mouse got the tape off in time per trial, see trial.trial_success()."""
+        return self.total_time() != self.duration
+
+    def total_bouts(self):
+        """Returns array of total bouts per trial, not counting a duration (300) at the end, see trial.total_bouts()."""
+        return self.lengths() - ~self.success()
+
+    def bouts_per_minute(self):
+        """Returns array of bouts per minute per trial, see trial.bouts_per_minute()."""
+        return (self.total_bouts() / self.total_time()) * 60
+
+    def idle_time(self, idle_threshold=15):
+        """Returns array of idle time in seconds per trial, see trial.idle_time().
+        As there, the interval between the last two items of a boutlist is not taken into account.
+        """
+        inter_bout_times, index = self.inter_bout_times()
+        idle = inter_bout_times > idle_threshold
+        return np.bincount(index[idle], weights=inter_bout_times[idle], minlength=len(self))
+
+    def inter_bout_times(self):
+        """Returns (inter-bout times, trial index of each) of all trials,
+        without the interval between the last two items of each boutlist (cf. trial.idle_time()).
+        """
+        index = self.trial_index()
+        counted = self.positions()[:-1] < self.lengths()[index[:-1]] - 2
+        return np.diff(self.values)[counted], index[:-1][counted]
+
+    def bout_intervals(self):
+        """Returns (intervals, trial index of each) of all intervals between consecutive actual bouts,
+        i.e. all but the interval to a duration (300) at the end of a boutlist (trial time-out).
+        """
+        index = self.trial_index()
+        bouts = counted_bouts(self.values, self.offsets, self.duration, count_sentinel=False)
+        consecutive = (index[1:] == index[:-1]) & bouts[1:]
+        return np.diff(self.values)[consecutive], index[:-1][consecutive]
+
+    def idle_time_sweep(self, thresholds):
+        """Takes array of idle thresholds in seconds, returns (idle time, number of idle periods)
+        per trial and threshold as 2D arrays (trials x thresholds), see idle_time().
+        Intervals are computed once; each is sorted into the thresholds it exceeds and the sums
+        are accumulated from the highest threshold down for all trials at once.
+        """
+        thresholds = np.asarray(thresholds, dtype=float)
+        order = np.argsort(thresholds)
+        n_thresholds = len(thresholds)
+        inter_bout_times, index = self.inter_bout_times()
+        # number of (sorted) thresholds each interval exceeds
+        exceeded = np.searchsorted(thresholds[order], inter_bout_times, side='left')
+        idle = exceeded > 0
+        cells = index[idle] * n_thresholds + exceeded[idle] - 1
+        shape = (len(self), n_thresholds)
+        idle_time = np.bincount(cells, weights=inter_bout_times[idle], minlength=len(self) * n_thresholds)
+        idle_periods = np.bincount(cells, minlength=len(self) * n_thresholds)
+        idle_time = np.cumsum(idle_time.reshape(shape)[:, ::-1], axis=1)[:, ::-1]
+        idle_periods = np.cumsum(idle_periods.reshape(shape)[:, ::-1], axis=1)[:, ::-1]
+        # back to the order thresholds were given in
+        unsorted = np.empty_like(order)
+        unsorted[order] = np.arange(n_thresholds)
+        return idle_time[:, unsorted], idle_periods[:, unsorted]
+
+    def auc(self):
+        """Returns array of the area under the curve per trial, see trial.area_under_the_curve():
+        trapezoidal rule over bout times (x) and bout numbers (y = 0, 1, ...).
+        """
+        index = self.trial_index()
+        positions = self.positions()[:-1]
+        counted = positions < self.lengths()[index[:-1]] - 1
+        areas = np.diff(self.values)[counted] * (positions[counted] + 0.5)
+        return np.bincount(index[:-1][counted], weights=areas, minlength=len(self))
+
+    def step_auc(self):
+        """Returns array of the exact area under the cumulative bout curve per trial, i.e. the integral of
+        the step function of bout times from 0 until trial end: sum over bouts of (trial end - bout time).
+        A duration (300) at the end of a boutlist adds nothing, as it is the trial end itself.
+        """
+        index = self.trial_index()
+        return np.bincount(index, weights=self.total_time()[index] - self.values, minlength=len(self))
+
+    def mean_curve_auc(self):
+        """Returns array of the exact area under the averaged cumulative bout curve per group (in order of
+        group categories); averaged at each time over the group's trials running then, like the Mean of
+        group_timecourses(). The averaged curve is a step function, too; it changes at every bout and trial end.
+        """
+        n_groups = len(self.group.categories)
+        codes = self.group.codes.astype(np.int64)
+        index = self.trial_index()
+        bouts = counted_bouts(self.values, self.offsets, self.duration, count_sentinel=False)
+        final = np.bincount(index[bouts], minlength=len(self))
+
+        # events: bouts add 1 to their group's sum of counts, trial ends remove the trial's count and the trial
+        times = np.concatenate((self.values[bouts], self.total_time()))
+        groups = np.concatenate((codes[index[bouts]], codes))
+        sums = np.concatenate((np.ones(bouts.sum(), dtype=np.int64), -final))
+        running = np.concatenate((np.zeros(bouts.sum(), dtype=np.int64), -np.ones(len(self), dtype=np.int64)))
+        order = np.lexsort((times, groups))
+        times, groups, sums, running = times[order], groups[order], sums[order], running[order]
+
+        starts = np.searchsorted(groups, np.arange(n_groups))
+        sums = np.cumsum(sums) - np.concatenate(([0], np.cumsum(sums)))[starts][groups]
+        running = np.bincount(codes, minlength=n_groups)[groups] + np.cumsum(running) \
+            - np.concatenate(([0], np.cumsum(running)))[starts][groups]
+        # state after event k holds until event k + 1 of the same group
+        same_group = groups[1:] == groups[:-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            areas = np.where(running[:-1] > 0, sums[:-1] / running[:-1], 0) * np.diff(times)
+        return np.bincount(groups[:-1][same_group], weights=areas[same_group], minlength=n_groups)
+
+    def mean_curve_auc_sd(self):
+        """Returns array of the error of the area under the averaged curve per group (in order of group categories)
+        as plot_results() shows it: square root of the sum over time steps of the variance (n-1) over the group's
+        trials of the area per time step (trapezoidal rule on Trial.timecourse300, see trial.auc_time_curve300()).
+        Twice an area is resolution times the sum of two bout counts, so n, sum and sum of squares of those
+        integer sums are accumulated exactly per group, one chunk of trials at a time (bounded by CHUNK_CELLS).
+        """
+        n_groups = len(self.group.categories)
+        steps = n_time_points(self.duration, self.resolution) - 1
+        n = np.zeros((n_groups, steps), dtype=np.int64)
+        sums, squares = np.zeros_like(n), np.zeros_like(n)
+        chunk = max(1, CHUNK_CELLS // (steps + 1))
+        for code in range(n_groups):
+            members = np.flatnonzero(self.group.codes == code)
+            for start in range(0, len(members), chunk):
+                curves = self.subset(members[start:start + chunk]).timecourses()
+                # sums of integers stay exact in float64, NaN (after trial end) counts as 0
+                pairs = curves[:, :-1] + curves[:, 1:]
+                del curves
+                n[code] += (~np.isnan(pairs)).sum(axis=0)
+                np.nan_to_num(pairs, copy=False)
+                sums[code] += pairs.sum(axis=0).astype(np.int64)
+                squares[code] += np.square(pairs, out=pairs).sum(axis=0).astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (n * squares - sums ** 2) / (n * (n - 1))
+        variance[n < 2] = np.nan
+        return np.sqrt(np.nansum(variance, axis=1)) * 0.5 * self.resolution
+
+    def timecourses(self, count_sentinel=True, dtype=float):
+        """Returns 2D array (trials x time points) of cumulative bouts, see timecourse_matrix();
+        with the default count_sentinel, row i equals the Trial.timecourse300 of the i-th trial.
+        """
+        return timecourse_matrix(self.values, self.offsets, self.duration, self.resolution, count_sentinel, dtype)
+
+    def timecourses_at(self, points, count_sentinel=True, dtype=float):
+        """Returns 2D array (trials x points) of cumulative bouts at the specified indices of time points only,
+        equal to .timecourses()[:, points] without building the other time points, see timecourse_points().
+        """
+        return timecourse_points(self.values, self.offsets, points, self.duration, self.resolution,
+                                 count_sentinel, dtype)
+
+    def bout_rates(self, seconds=30, rolling=False):
+        """Returns (2D array of bout rates in bouts per minute (trials x time windows), window end times in seconds).
+        Windows are consecutive bins of the specified length in seconds or, if rolling, windows of that length
+        ending at every time point from then on. Rates are differences of the cumulative time courses of actual
+        bouts at the window ends, for all trials and windows at once; NaN for windows after trial end.
+        Only the time points at window ends are counted (see timecourses_at()).
+        """
+        times = time_grid(self.duration, self.resolution)
+        steps = max(1, int(round(seconds / self.resolution)))
+        if rolling:
+            ends = np.arange(steps, len(times))
+        else:
+            ends = np.arange(steps, len(times), steps)
+        rates = (self.timecourses_at(ends, count_sentinel=False)
+                 - self.timecourses_at(ends - steps, count_sentinel=False)) / (steps * self.resolution) * 60
+        return rates, times[ends]
+
+    def time_index(self):
+        """Returns index of time points for time course DataFrames, see time_index()."""
+        return time_index(self.duration, self.resolution)
+
+    def metrics(self):
+        """Returns DataFrame of trial metrics."""
+        return pd.DataFrame({
+            'Group': np.asarray(self.group),
+            'Mouse': np.asarray(self.mouse),
+            'Date': np.asarray(self.date),
+            'Success': self.success(),
+            'Total bouts': self.total_bouts(),
+            'Total time': self.total_time(),
+            'Idle time': self.idle_time(),
+            'Bouts per minute': self.bouts_per_minute(),
+            'AUC (Area under the trial time course curve)': self.auc()
+        })
+
+    def group_timecourses(self):
+        """Returns dictionary of group : DataFrame of the time courses of the group's trials (one column per trial,
+        labeled by mouse, see trial_labels()), preceded by columns of their Mean, SD(n-1) and n per time point.
+        Statistics are computed for all groups at once from the bouts (see timecourse.group_statistics()),
+        time courses of single trials one group at a time.
+        """
+        index = self.time_index()
+        mean, sd, n = group_statistics(self.values, self.offsets, self.group.codes, len(self.group.categories),
+                                       self.duration, self.resolution)
+        tc_groups = dict()
+        for code, group in enumerate(self.group.categories):
+            members = np.flatnonzero(self.group.codes == code)
+            if len(members) == 0:
+                continue
+            df_timecourse = pd.DataFrame({'Mean': mean[code], 'SD(n-1)': sd[code], 'n': n[code]}, index=index)
+            timecourses = self.subset(members).timecourses()
+            labels = trial_labels(self.mouse[members], self.date[members])
+            df_mice = pd.DataFrame(dict(zip(labels, timecourses)), index=index)
+            tc_groups[group] = pd.concat([df_timecourse, df_mice], axis=1)
+        return tc_groups
+
+
+def trial_labels(mice, dates):
+    """Takes mouse and date per trial of one group, returns list of unique column labels of their time courses:
+    the mouse, or 'mouse (date)' for a mouse with several trials; labels that are still not unique
+    (e.g. trials of several folders) are numbered.
+    """
+    mice = [str(mouse) for mouse in mice]
+    counts = pd.Series(mice).value_counts()
+    labels, used = [], set()
+    for mouse, date in zip(mice, dates):
+        label = mouse if counts[mouse] == 1 else f'{mouse} ({date})'
+        number = 1
+        while label in used:
+            number += 1
+            label = f'{mouse} ({date}) ~{number}'
+        used.add(label)
+        labels.append(label)
+    return labels
+
+
+def trial_columns(df_timecourse):
+    """Returns list of the labels of the time course columns of single trials of a group_timecourses() DataFrame."""
+    return [column for column in df_timecourse.columns if column not in ('Mean', 'SD(n-1)', 'n')]
+
+
+def time_index(duration=DURATION, resolution=1):
+    """Returns index of time points for time course DataFrames:
+    full seconds 0, 1, ... for a resolution of 1 s, times in seconds otherwise.
+    """
+    if resolution == 1:
+        return pd.RangeIndex(len(time_grid(duration)))
+    return pd.Index(time_grid(duration, resolution).round(9))
+
+
+def matrix_group_statistics(matrix, codes, n_groups):
+    """Takes 2D array (trials x columns) and group code per trial,
+    returns (mean, SD(n-1), n) per group and column as 2D arrays (groups x columns), ignoring NaN.
+    """
+    valid = ~np.isnan(matrix)
+    shape = (n_groups, matrix.shape[1])
+    n, sums, squares = np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape)
+    np.add.at(n, codes, valid)
+    np.add.at(sums, codes, np.where(valid, matrix, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums / n
+        np.add.at(squares, codes, np.where(valid, matrix - mean[codes], 0) ** 2)
+        sd = np.sqrt(squares / (n - 1))
+    sd[n < 2] = np.nan
+    return mean, sd, n
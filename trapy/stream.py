@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from .parser import DURATION
+from .timecourse import timecourse_matrix, n_time_points, CHUNK_CELLS
+from .store import time_index
+
+
+class GroupAccumulator:
+    """Running count, mean and M2 (sum of squared deviations) per time point of the time courses
+    folded into it; NaN (after trial end) is skipped. Trials are folded one at a time or in chunks
+    (Welford's algorithm, chunks are merged like accumulators), so memory does not grow with trials.
+    Accumulators of the same time points can be merged, e.g. from separate runs (Chan et al.).
+    Attributes:
+        .count         - number of time courses with a value per time point
+        .mean          - running mean per time point
+        .m2            - running sum of squared deviations from the mean per time point
+    """
+
+    def __init__(self, n_points):
+        self.count = np.zeros(n_points, dtype=np.int64)
+        self.mean = np.zeros(n_points)
+        self.m2 = np.zeros(n_points)
+
+    def add(self, curve):
+        """Folds the time course of one trial into the accumulator."""
+        curve = np.asarray(curve, dtype=float)
+        valid = ~np.isnan(curve)
+        self.count[valid] += 1
+        delta = curve[valid] - self.mean[valid]
+        self.mean[valid] += delta / self.count[valid]
+        self.m2[valid] += delta * (curve[valid] - self.mean[valid])
+
+    def add_many(self, curves):
+        """Folds a 2D array (trials x time points) of time courses into the accumulator."""
+        curves = np.asarray(curves, dtype=float)
+        chunk = GroupAccumulator(curves.shape[1])
+        valid = ~np.isnan(curves)
+        chunk.count = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk.mean = np.where(chunk.count > 0, np.where(valid, curves, 0).sum(axis=0) / chunk.count, 0)
+        chunk.m2 = (np.where(valid, curves - chunk.mean, 0) ** 2).sum(axis=0)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Folds all time courses of another accumulator of the same time points into this one."""
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(count > 0, other.count / count, 0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * share
+        self.count = count
+        return self
+
+    def statistics(self):
+        """Returns (mean, SD(n-1), n) per time point; NaN where undefined."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+            sd = np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        return mean, sd, self.count.copy()
+
+
+class TimecourseAccumulator:
+    """Per-group GroupAccumulators of time courses, for group statistics without keeping the time courses
+    of single trials: memory grows with groups x time points, not with trials x time points.
+    Attributes:
+        .duration      - maximal trial time in seconds
+        .resolution    - time between time points in seconds
+        .groups        - dictionary of group : GroupAccumulator
+    Methods:
+        .add()          - folds the time course of one trial (boutlist) into its group
+        .add_store()    - folds all trials of a TrialStore, a bounded chunk of trials at a time
+        .merge()        - folds another TimecourseAccumulator (same duration and resolution) into this one
+        .to_dfs()       - returns dictionary of group : DataFrame of Mean, SD(n-1) and n per time point
+    """
+
+    def __init__(self, duration=DURATION, resolution=1):
+        self.duration = duration
+        self.resolution = resolution
+        self.groups = dict()
+
+    def group(self, group):
+        """Returns the GroupAccumulator of a group, created if new."""
+        if group not in self.groups:
+            self.groups[group] = GroupAccumulator(n_time_points(self.duration, self.resolution))
+        return self.groups[group]
+
+    def add(self, group, boutlist):
+        curve = timecourse_matrix(boutlist, [0, len(boutlist)], self.duration, self.resolution)[0]
+        self.group(group).add(curve)
+
+    def add_store(self, store):
+        if (store.duration, store.resolution) != (self.duration, self.resolution):
+            raise ValueError('TrialStore has another duration or resolution than the accumulator')
+        chunk = max(1, CHUNK_CELLS // n_time_points(self.duration, self.resolution))
+        for code, group in enumerate(store.group.categories):
+            members = np.flatnonzero(store.group.codes == code)
+            for start in range(0, len(members), chunk):
+                self.group(group).add_many(store.subset(members[start:start + chunk]).timecourses())
+        return self
+
+    def merge(self, other):
+        if (other.duration, other.resolution) != (self.duration, self.resolution):
+            raise ValueError('Accumulators of other duration or resolution can not be merged')
+        for group, accumulator in other.groups.items():
+            self.group(group).merge(accumulator)
+        return self
+
+    def to_dfs(self):
+        index = time_index(self.duration, self.resolution)
+        tc_groups = dict()
+        for group in sorted(self.groups):
+            mean, sd, n = self.groups[group].statistics()
+            tc_groups[group] = pd.DataFrame({'Mean': mean, 'SD(n-1)': sd, 'n': n}, index=index)
+        return tc_groups
@@ -0,0 +1,81 @@
+import os
+import datetime
+import numpy as np
+from .parser import DURATION
+
+# default bouts per minute of the groups, cycled for more groups
+GROUP_RATES = (20, 15, 10, 25)
+
+
+def generate_boutlist(rng, rate=20, duration=DURATION, success_rate=0.5, burstiness=0.5):
+    """Returns (times of time stamps in seconds, whether the trial timed out) of one synthetic trial.
+    Bouts follow a Poisson process of rate bouts per minute, modulated per 10-second window by a
+    gamma factor of variance burstiness (0: constant rate), so bouts cluster and pause as in real trials.
+    With probability success_rate, the mouse gets the tape off at a uniform time before duration
+    (the last time stamp); otherwise the trial times out and a last time stamp is added after duration.
+    """
+    success = rng.random() < success_rate
+    end = rng.uniform(0.1, 1) * duration if success else duration
+    windows = int(np.ceil(end / 10))
+    if burstiness > 0:
+        factors = rng.gamma(1 / burstiness, burstiness, size=windows)
+    else:
+        factors = np.ones(windows)
+    counts = rng.poisson(rate / 6 * factors)
+    times = np.concatenate([rng.uniform(10 * i, 10 * (i + 1), count) for i, count in enumerate(counts)])
+    times = np.sort(times[times < end])
+    if success:
+        times = np.append(times, end)
+    else:
+        times = np.append(times, duration + rng.uniform(0, 5))
+    return np.round(times, 2), not success
+
+
+def format_boutlist(times):
+    """Returns txt content (bytes) of the timer app for times of time stamps in seconds,
+    e.g. b'1. 0h 0m 9s 44ms count : 0' per line; 'ms' are hundredths of a second as in the app.
+    """
+    hundredths = np.round(np.asarray(times, dtype=float) * 100).astype(np.int64)
+    lines = []
+    for i, value in enumerate(hundredths):
+        seconds, ms = divmod(int(value), 100)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        lines.append(f'{i + 1}. {hours}h {minutes}m {seconds}s {ms}ms count : 0\n')
+    return ''.join(lines).encode()
+
+
+def synthetic_contents(groups=4, mice=10, days=1, rates=GROUP_RATES, success_rate=0.5, burstiness=0.5,
+                       duration=DURATION, start_date=datetime.date(2020, 1, 1), seed=0):
+    """Yields (file name, txt content) of a synthetic cohort: one trial per group, mouse and day,
+    named "yymmddaa*g.txt" ("Group 1", ...). Bouts per minute per group are taken from rates (cycled),
+    varied per mouse by ±20 %; see generate_boutlist(). Mouse numbers are two digits, so up to 100 mice
+    per group and day. The same seed gives the same cohort.
+    """
+    if not 0 < mice <= 100:
+        raise ValueError('mice must be between 1 and 100 (two-digit mouse numbers)')
+    rng = np.random.default_rng(seed)
+    for day in range(days):
+        date = (start_date + datetime.timedelta(days=day)).strftime('%y%m%d')
+        for group in range(groups):
+            rate = rates[group % len(rates)]
+            for mouse in range(mice):
+                mouse_rate = rate * rng.uniform(0.8, 1.2)
+                times, timed_out = generate_boutlist(rng, mouse_rate, duration, success_rate, burstiness)
+                yield f'{date}{mouse % 100:02d}Group {group + 1}.txt', format_boutlist(times)
+
+
+def write_cohort(folder, groups=4, mice=10, days=1, rates=GROUP_RATES, success_rate=0.5, burstiness=0.5,
+                 duration=DURATION, start_date=datetime.date(2020, 1, 1), seed=0):
+    """Writes the txt files of synthetic_contents() to folder (created if missing); returns sorted list of paths.
+    E.g. groups=10, mice=100, days=20 writes 20000 files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for name, content in synthetic_contents(groups, mice, days, rates, success_rate, burstiness,
+                                            duration, start_date, seed):
+        path_to_file = os.path.join(folder, name)
+        with open(path_to_file, 'wb') as file:
+            file.write(content)
+        paths.append(path_to_file)
+    return sorted(paths)
@@ -0,0 +1,144 @@
+import numpy as np
+from .parser import DURATION
+
+# maximal number of trials x time points histogram cells held at once by timecourse_matrix()
+CHUNK_CELLS = 2 ** 22
+
+
+def time_grid(duration=DURATION, resolution=1):
+    """Returns array of the time points 0, resolution, 2 * resolution, ..., duration in seconds."""
+    return np.arange(n_time_points(duration, resolution)) * resolution
+
+
+def n_time_points(duration=DURATION, resolution=1):
+    """Returns number of time points of time_grid()."""
+    return int(round(duration / resolution)) + 1
+
+
+def grid_positions(times, duration=DURATION, resolution=1):
+    """Takes array of times in seconds, returns index of the first time point of time_grid() at or after
+    each time, i.e. from which on a bout is counted; n_time_points() for times after the grid.
+    Times less than a millionth of the resolution after a time point count as on it (float rounding).
+    """
+    times = np.asarray(times, dtype=float) - resolution * 1e-6
+    return np.searchsorted(time_grid(duration, resolution), times, side='left')
+
+
+def trial_ends(values, offsets, duration=DURATION, resolution=1):
+    """Takes ragged array of boutlists (values + offsets, see TrialStore), returns grid position
+    of the last boutlist item (trial end) per trial; curves are NaN after it. -1 for empty boutlists.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    filled = np.diff(offsets) > 0
+    ends = np.full(len(offsets) - 1, -1, dtype=np.int64)
+    ends[filled] = grid_positions(np.asarray(values, dtype=float)[offsets[1:][filled] - 1], duration, resolution)
+    return ends
+
+
+def counted_bouts(values, offsets, duration=DURATION, count_sentinel=True):
+    """Takes ragged array of boutlists, returns bool array of the items that count as bouts in time courses:
+    all, or with count_sentinel=False all but a duration (300) at the end of a boutlist (trial time-out).
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counted = np.ones(len(values), dtype=bool)
+    if not count_sentinel:
+        last = offsets[1:][np.diff(offsets) > 0] - 1
+        counted[last[values[last] == duration]] = False
+    return counted
+
+
+def timecourse_matrix(values, offsets, duration=DURATION, resolution=1, count_sentinel=True, dtype=float):
+    """Takes ragged array of boutlists (values + offsets, see TrialStore),
+    returns 2D array (trials x time points of time_grid()) of cumulative bouts at every time point.
+    A trial's curve is NaN after the first time point at or after its last boutlist item (trial end).
+    With count_sentinel, a duration (300) at the end of a boutlist (trial time-out) is counted
+    as in Trial.timecourse300, otherwise only actual bouts are counted as in Trial.timecourse.
+    Computed for chunks of trials at once: every bout is sorted into the first time point it is counted at,
+    bouts are histogrammed per trial and time point and the histogram is summed up cumulatively.
+    Temporary memory is bounded by CHUNK_CELLS; pass dtype=np.float32 to halve the returned array.
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_trials = len(offsets) - 1
+    n_points = n_time_points(duration, resolution)
+    lengths = np.diff(offsets)
+    positions = grid_positions(values, duration, resolution)
+    counted = counted_bouts(values, offsets, duration, count_sentinel)
+    ends = trial_ends(values, offsets, duration, resolution)
+
+    curves = np.empty((n_trials, n_points), dtype=dtype)
+    chunk = max(1, CHUNK_CELLS // (n_points + 1))
+    for start in range(0, n_trials, chunk):
+        stop = min(start + chunk, n_trials)
+        items = slice(offsets[start], offsets[stop])
+        index = np.repeat(np.arange(stop - start), lengths[start:stop])[counted[items]]
+        bins = index * (n_points + 1) + positions[items][counted[items]]
+        counts = np.bincount(bins, minlength=(stop - start) * (n_points + 1)).reshape(stop - start, n_points + 1)
+        np.cumsum(counts[:, :-1], axis=1, out=curves[start:stop])
+        curves[start:stop][np.arange(n_points)[np.newaxis, :] > ends[start:stop, np.newaxis]] = np.nan
+    return curves
+
+
+def timecourse_points(values, offsets, points, duration=DURATION, resolution=1, count_sentinel=True, dtype=float):
+    """Takes ragged array of boutlists and array of indices of time points of time_grid(),
+    returns 2D array (trials x points) equal to timecourse_matrix()[:, points], without the other time points:
+    the bouts of all trials are sorted by (trial, time point) into one key array, which is searched
+    for every trial and requested time point at once. NaN after trial end as in timecourse_matrix().
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    points = np.asarray(points, dtype=np.int64)
+    n_trials = len(offsets) - 1
+    n_points = n_time_points(duration, resolution)
+    index = np.repeat(np.arange(n_trials), np.diff(offsets))
+    counted = counted_bouts(values, offsets, duration, count_sentinel)
+    ends = trial_ends(values, offsets, duration, resolution)
+
+    keys = np.sort(index[counted] * (n_points + 1) + grid_positions(values[counted], duration, resolution))
+    starts = np.searchsorted(keys, np.arange(n_trials) * (n_points + 1), side='left')
+    queries = np.arange(n_trials)[:, np.newaxis] * (n_points + 1) + points[np.newaxis, :]
+    curves = (np.searchsorted(keys, queries, side='right') - starts[:, np.newaxis]).astype(dtype)
+    curves[points[np.newaxis, :] > ends[:, np.newaxis]] = np.nan
+    return curves
+
+
+def group_statistics(values, offsets, codes, n_groups, duration=DURATION, resolution=1, count_sentinel=True):
+    """Takes ragged array of boutlists and group code per trial, returns (mean, SD(n-1), n) of the
+    timecourse_matrix() curves per group and time point as 2D arrays (groups x time points), ignoring NaN.
+    Computed exactly from the bouts, without the curves of single trials: every bout changes the sum and
+    the sum of squares of its group's counts from its time point on, every trial end removes the trial's
+    final count from them. Memory grows with groups x time points, not trials x time points.
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+    n_points = n_time_points(duration, resolution)
+    index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    positions = grid_positions(values, duration, resolution)
+    ends = trial_ends(values, offsets, duration, resolution)
+
+    # bouts counted before their trial's end, in order of time per trial
+    counted = counted_bouts(values, offsets, duration, count_sentinel) & (positions <= ends[index])
+    order = np.lexsort((positions[counted], index[counted]))
+    index, positions = index[counted][order], positions[counted][order]
+    final = np.bincount(index, minlength=len(offsets) - 1)
+    rank = np.arange(1, len(index) + 1) - np.repeat(np.cumsum(final) - final, final)
+
+    trials = ends >= 0
+    cells = n_groups * (n_points + 1)
+    at_bout = codes[index] * (n_points + 1) + positions
+    at_start = codes[trials] * (n_points + 1)
+    after_end = codes[trials] * (n_points + 1) + np.minimum(ends[trials] + 1, n_points)
+    n = np.bincount(at_start, minlength=cells) - np.bincount(after_end, minlength=cells)
+    sums = np.bincount(at_bout, minlength=cells) - np.bincount(after_end, weights=final[trials], minlength=cells)
+    squares = np.bincount(at_bout, weights=2 * rank - 1, minlength=cells) \
+        - np.bincount(after_end, weights=final[trials] ** 2, minlength=cells)
+
+    n, sums, squares = (np.cumsum(np.rint(diffs).astype(np.int64).reshape(n_groups, n_points + 1)[:, :-1], axis=1)
+                        for diffs in (n, sums, squares))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums / n
+        sd = np.sqrt((n * squares - sums ** 2) / (n * (n - 1)))
+    sd[n < 2] = np.nan
+    return mean, sd, n
@@ -1,30 +1,120 @@
 import os
 import sys
 import math
-import warnings
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from scipy import stats
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
-from .trial import Trial
+from .trial import Trial, is_trial_file
+from .parser import read_boutlists, drop_empty, DURATION
+from .cache import cache_for
+from .store import TrialStore, matrix_group_statistics, trial_columns
+from .timecourse import n_time_points
+from .stream import TimecourseAccumulator
+from .archive import save_experiment, load_experiment
+from .sources import trials_from_contents
+from .profiling import Profiler, stage, profiled
+from .resampling import resampling_statistics
 
+ARCHIVE_FILENAME = 'TapeResponseAssay.trapy'
+# characters not allowed in excel sheet names and their maximal length
+SHEET_NAME_FORBIDDEN = '[]:*?/\\'
+SHEET_NAME_LENGTH = 31
 
-def instantiate(folder):
-    """Crawls folder for text files and makes them instances of the Trial() Class.
-    Returns a list of the created objects
+
+def instantiate(folder, workers=None, cache=None, duration=DURATION, resolution=1, paths=None, profiler=None):
+    """Crawls folder for text files and makes them instances of the Trial() Class;
+    with a list of paths to txt files (e.g. from DatasetIndex.query()), makes those instead.
+    Returns a list of the created objects; txt files without time stamps are skipped with a warning.
+    With workers > 1, files are parsed and analyzed in a pool of that many processes.
+    With a MetricsCache, only new or changed files are analyzed.
+    With a Profiler, the stages 'list files', 'parse' and 'trials' are recorded.
     """
-    trials = [Trial(path_to_trial) for path_to_trial in txt_file_path_list(folder)]
+    if paths is None:
+        with stage(profiler, 'list files'):
+            paths = txt_file_path_list(folder)
+    with stage(profiler, 'parse'):
+        boutlists = analyze(paths, workers, cache, duration)
+        if cache is not None:
+            cache.prune(folder, paths)
+            cache.save()
+    with stage(profiler, 'trials'):
+        paths, boutlists = drop_empty(paths, boutlists)
+        trials = [Trial(path_to_trial, boutlist, duration=duration, resolution=resolution)
+                  for path_to_trial, boutlist in zip(paths, boutlists)]
     sys.stdout.write('Calculated Metrics from txt files in ' + folder + '\n')
     return trials
 
 
+def analyze(paths, workers=None, cache=None, duration=DURATION):
+    """Returns list of boutlists (arrays of times of bouts in seconds) of the specified txt files.
+    Boutlists of files unchanged since they were put into the cache are taken from it,
+    all others are computed - in a pool of processes if workers > 1 - and put into it.
+    The cache has to be made for the same duration (see MetricsCache).
+    """
+    if cache is None:
+        boutlists = [None] * len(paths)
+    else:
+        boutlists = [cache.get(path_to_trial) for path_to_trial in paths]
+    missing = [i for i, boutlist in enumerate(boutlists) if boutlist is None]
+    missing_paths = [paths[i] for i in missing]
+    if workers is not None and workers > 1 and len(missing_paths) > 1:
+        computed = analyze_parallel(missing_paths, workers, duration)
+    else:
+        computed = analyze_files(missing_paths, duration)
+    for i, boutlist in zip(missing, computed):
+        boutlists[i] = boutlist
+        if cache is not None:
+            cache.put(paths[i], boutlist)
+    return boutlists
+
+
+def analyze_parallel(paths, workers, duration=DURATION):
+    """Returns analyze_files(paths, duration), parsing in a pool of processes.
+    Paths are processed in chunks and returned in order, so the result equals the serial one.
+    """
+    chunksize = max(1, math.ceil(len(paths) / (workers * 4)))
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+    boutlists = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_boutlists in executor.map(analyze_files, chunks, [duration] * len(chunks)):
+            boutlists.extend(chunk_boutlists)
+    return boutlists
+
+
+def analyze_files(paths, duration=DURATION):
+    """Parses txt files; worker function of analyze_parallel(). Returns list of boutlists per file.
+    TRA computes metrics and time courses of all trials at once from its TrialStore,
+    Trial() objects compute them on first access.
+    """
+    return read_boutlists(paths, duration)
+
+
+def stream_timecourses(folder, duration=DURATION, resolution=1, chunk=256, accumulator=None):
+    """Crawls folder for txt files and folds their time courses into a TimecourseAccumulator,
+    parsing a chunk of files at a time; neither trials nor time courses are kept.
+    Pass the accumulator of another run to add this folder to it.
+    Returns the accumulator; see TimecourseAccumulator.to_dfs() for the group statistics.
+    """
+    if accumulator is None:
+        accumulator = TimecourseAccumulator(duration, resolution)
+    paths = txt_file_path_list(folder)
+    for start in range(0, len(paths), chunk):
+        chunk_paths = paths[start:start + chunk]
+        chunk_paths, boutlists = drop_empty(chunk_paths, read_boutlists(chunk_paths, duration))
+        trials = [Trial(path_to_trial, boutlist, duration=duration, resolution=resolution)
+                  for path_to_trial, boutlist in zip(chunk_paths, boutlists)]
+        accumulator.add_store(TrialStore.from_trials(trials, duration, resolution))
+    return accumulator
+
+
 def txt_file_path_list(folder):
-    """Returns sorted list of paths to ~.txt files found in specified folder."""
+    """Returns sorted list of paths to ~.txt files found in specified folder.
+    See DatasetIndex to find them in many folders and their subfolders.
+    """
     filenames = os.listdir(folder)
     txt_files = []
     for file in filenames:
-        if file[-3:] == 'txt':
+        if is_trial_file(file):
             txt_files.append(os.path.join(folder, file))
         else:
             pass
@@ -33,162 +123,375 @@ def txt_file_path_list(folder):
 
 
 class TRA:
-    """Tape Response Assay class. Specify path to txt files when initiating.
+    """Tape Response Assay class. Specify path to txt files when initiating;
+    optionally the number of worker processes to analyze them in parallel
+    and whether to cache the analysis on disk (True: in folder, or path to the cache file).
+    Maximal trial time (duration) and time between time points of time courses (resolution)
+    can be set in seconds, e.g. duration=600 for 10-minute trials or resolution=0.01 for 10 ms time points.
+    Instead of all txt files in folder, a list of paths to txt files (e.g. from DatasetIndex.query()) can be
+    analyzed, or txt contents without files on disk: a zip or tar archive (path, bytes or file-like object)
+    or an iterable of (name, content) pairs, see sources.iter_contents(); folder is then where results are saved.
+    With streaming=True, group time courses are folded into running accumulators instead of being kept
+    per mouse, so data holds only Mean, SD(n-1) and n per group.
+    Wall time and calls of every stage (file listing, parsing, metrics, time courses, plots, export, ...)
+    are recorded by a Profiler, see .timings; pass Profiler(memory=True, profile=True, hooks=[...])
+    to also record peak memory, capture cProfile statistics or get called back after every stage.
     Attributes:
         .folder        - specified path
+        .paths         - specified list of paths to txt files (None: all in folder)
+        .sources       - list of paths of the txt files (names of contents) of the trials, in order of the store
+        .in_memory     - whether trials were made from contents instead of files (can not be refreshed)
+        .workers       - number of processes used to analyze txt files (None: serial)
+        .cache         - MetricsCache of boutlists per txt file
+        .duration      - maximal trial time in seconds (300)
+        .resolution    - time between time points of time courses in seconds (1)
+        .streaming     - whether data is aggregated by running accumulators (no time courses per mouse)
+        .accumulator   - TimecourseAccumulator of the group time courses in streaming mode, mergeable
         .trials        - list of trial objects
+        .store         - TrialStore: columnar boutlists and categorical group, mouse, date of all trials
         .groups        - set of experimental groups
         .dates         - set of dates of trials
         .mice          - set of mouse numbers
         .metrics       - DataFrame of metrics per trial
         .data          - Dictionary of DataFrames of bout-time-data per group
+        .rates         - Dictionary of (seconds, rolling) : bout rates computed by .bout_rates()
+        .profiler      - Profiler recording the stages of the analysis
+        .timings       - DataFrame of calls, seconds and peak memory per stage, see Profiler.report()
     Methods:
+        .refresh()      - re-crawls folder, analyzes only new or changed txt files
+                          and updates trials, metrics and data
         .to_excel()     - writes metrics and time courses to
                          'TapeResponseAssay.xlsx'
+        .save()         - writes boutlists, metrics and time courses to a binary archive (directory)
+        TRA.load()      - returns TRA of an archive written by .save(), memory-mapped, without reading txt files
         .plot_data()    - plots single trial time courses and summary of those per group,
                           saves figure to .png file
+        .plot_groups()  - plots single trial time courses and summary per group, saves one .png file
+                          per group, rendered in parallel and skipped if unchanged
         .plot_results() - plots relevant, summarized metrics and saves figure as .png file
+        .auc_summary()  - returns DataFrames of the exact area under the time course per trial and per group
+        .idle_time_sweep() - returns DataFrames of idle time and idle periods per trial for many thresholds
+        .ibi_distribution() - returns DataFrame of all inter-bout intervals by group, mouse and date
+        .bout_rates()   - returns bout rates per trial and group in time bins or rolling windows
+        .plot_rates()   - plots group bout rates and saves figure as .png file
+        .metric_statistics() - returns DataFrames of bootstrap confidence intervals and permutation tests
+                          between groups for every metric
+        .timecourse_statistics() - returns the same for the time courses at every specified second
     """
 
-    def __init__(self, folder='/'):
+    def __init__(self, folder='/', workers=None, cache=False, duration=DURATION, resolution=1, streaming=False,
+                 paths=None, contents=None, profiler=None):
+        self.profiler = Profiler() if profiler is None else profiler
         self.folder = folder
-        self.trials = instantiate(self.folder)
-        self.groups = set(sorted(set(trial.group for trial in self.trials)))
-        self.dates = set(trial.date for trial in self.trials)
-        self.mice = set(trial.mouse for trial in self.trials)
-        self.metrics = trials_to_df(self.trials)
-        self.data = timecourses_to_dfs(self)
-
-    def plot_data(self, seconds=300):
-        """Returns an array of plots of bout-time data and saves it in TRA.folder as png file."""
+        self.paths = None if paths is None else list(paths)
+        self.in_memory = contents is not None
+        self.workers = workers
+        self.duration = duration
+        self.resolution = resolution
+        self.streaming = streaming
+        self.accumulator = None
+        self.cache = cache_for(self.folder, cache, self.duration)
+        with self.profiler.stage('TRA'):
+            if self.in_memory:
+                with self.profiler.stage('parse'):
+                    self.trials = trials_from_contents(contents, self.duration, self.resolution)
+                sys.stdout.write(f'Calculated Metrics from {len(self.trials)} txt contents\n')
+            else:
+                self.trials = instantiate(self.folder, self.workers, self.cache, self.duration, self.resolution,
+                                          self.paths, self.profiler)
+            self.summarize()
+
+    @property
+    def timings(self):
+        return self.profiler.report()
+
+    def summarize(self):
+        """(Re-)computes store, groups, dates, mice, metrics and data from trials."""
+        with self.profiler.stage('store'):
+            self.store = TrialStore.from_trials(self.trials, self.duration, self.resolution)
+            self.groups = set(self.store.group.categories)
+            self.dates = set(self.store.date.categories)
+            self.mice = set(self.store.mouse.categories)
+        with self.profiler.stage('metrics'):
+            self.metrics = self.store.metrics()
+        with self.profiler.stage('time courses'):
+            if self.streaming:
+                self.accumulator = TimecourseAccumulator(self.duration, self.resolution).add_store(self.store)
+                self.data = self.accumulator.to_dfs()
+            else:
+                self.data = timecourses_to_dfs(self)
+        self.rates = dict()
+
+    @profiled('save')
+    def save(self, path=None):
+        """Writes boutlists, metrics and group time courses to a binary archive, by default
+        'TapeResponseAssay.trapy' in TRA.folder: a directory of one .npy file per column, see
+        archive.save_experiment(). Returns the path. Reload with TRA.load(path).
+        """
+        if path is None:
+            path = os.path.join(self.folder, ARCHIVE_FILENAME)
+        save_experiment(self, path)
+        sys.stdout.write(f'Saved experiment to {path}\n')
+        return path
+
+    @classmethod
+    def load(cls, path, mmap=True, profiler=None):
+        """Returns TRA of an archive written by TRA.save(), without reading or analyzing txt files.
+        With mmap, boutlists and time courses are memory-mapped read-only (see archive.load_experiment()),
+        so even large experiments open in milliseconds. Trials keep the paths of their txt files, and a TRA
+        made from a list of paths keeps it, so .refresh() re-analyzes those (else all txt files of the folder).
+        """
+        if profiler is None:
+            profiler = Profiler()
+        with profiler.stage('load'):
+            archive = load_experiment(path, mmap)
+        manifest = archive['manifest']
+        experiment = cls.__new__(cls)
+        experiment.profiler = profiler
+        experiment.folder = manifest['folder']
+        experiment.paths = manifest.get('paths')
+        experiment.in_memory = manifest.get('in_memory', False)
+        experiment.workers = None
+        experiment.duration = manifest['duration']
+        experiment.resolution = manifest['resolution']
+        experiment.streaming = manifest['streaming']
+        experiment.cache = cache_for(experiment.folder, False, experiment.duration)
+        # Trial() objects are made from the store on first access of .trials
+        experiment._trials = None
+        experiment._sources = manifest.get('sources') or [os.path.join(experiment.folder, name)
+                                                          for name in manifest['names']]
+        store = archive['store']
+        experiment.store = store
+        experiment.groups = set(store.group.categories)
+        experiment.dates = set(store.date.categories)
+        experiment.mice = set(store.mouse.categories)
+        experiment.metrics = archive['metrics']
+        experiment.data = archive['data']
+        experiment.rates = dict()
+        experiment.accumulator = None
+        if experiment.streaming:
+            experiment.accumulator = TimecourseAccumulator(experiment.duration, experiment.resolution)
+            for group, (count, mean, m2) in archive['accumulator'].items():
+                accumulator = experiment.accumulator.group(group)
+                accumulator.count, accumulator.mean, accumulator.m2 = np.array(count), np.array(mean), np.array(m2)
+        sys.stdout.write(f'Loaded experiment from {path}\n')
+        return experiment
+
+    @property
+    def trials(self):
+        if self._trials is None:
+            self._trials = [Trial(source, self.store.boutlist(i), duration=self.duration, resolution=self.resolution)
+                            for i, source in enumerate(self._sources)]
+        return self._trials
+
+    @property
+    def sources(self):
+        if self._trials is None:
+            return list(self._sources)
+        return [trial.path_to_file for trial in self._trials]
+
+    @trials.setter
+    def trials(self, trials):
+        self._trials = trials
+
+    @profiled('refresh')
+    def refresh(self):
+        """Re-crawls folder for txt files (or checks the specified paths); only new or changed files are analyzed,
+        trials of deleted files are dropped. Updates trials, metrics and data in place.
+        Returns list of paths of the (re-)analyzed files.
+        """
+        if self.in_memory:
+            raise ValueError('TRA made from txt contents instead of files can not be refreshed')
+        if self.paths is None:
+            paths = txt_file_path_list(self.folder)
+        else:
+            paths = [path_to_trial for path_to_trial in self.paths if os.path.isfile(path_to_trial)]
+        known = {trial.path_to_file: trial for trial in self.trials}
+        stale = [path_to_trial for path_to_trial in paths
+                 if path_to_trial not in known or not self.cache.is_current(path_to_trial)]
+        with self.profiler.stage('parse'):
+            boutlists = analyze(stale, self.workers, self.cache, self.duration)
+            self.cache.prune(self.folder, paths)
+            self.cache.save()
+        with self.profiler.stage('trials'):
+            for path_to_trial in stale:
+                known.pop(path_to_trial, None)
+            known.update((path_to_trial, Trial(path_to_trial, boutlist, duration=self.duration,
+                                               resolution=self.resolution))
+                         for path_to_trial, boutlist in zip(*drop_empty(stale, boutlists)))
+        self.trials = [known[path_to_trial] for path_to_trial in paths if path_to_trial in known]
+        self.summarize()
+        sys.stdout.write(f'Updated metrics of {len(stale)} txt files in {self.folder}\n')
+        return stale
+
+    @profiled('plot_data')
+    def plot_data(self, seconds=None, skip_unchanged=False):
+        """Returns an array of plots of bout-time data and saves it in TRA.folder as png file.
+        Time courses are plotted until the specified second, by default until duration.
+        With skip_unchanged, the figure is not rendered again (returns None) if the png file
+        was saved from the same data before; see .plot_groups() for one file per group.
+        """
         # plt array of subfigures in 2 columns and (nr of groups + 1) rows:
         # - left: single bout-time-curves per group
         # - right: group average ± SD
         # - bottom row:
         #   - left: all group averages ± SD
         #   - right: all group averages ± SEM
+        # matplotlib is only imported when plotting
+        from .plotting import new_figure, add_timecourses, figure_fingerprint, is_unchanged, record_fingerprints
+        if seconds is None:
+            seconds = self.duration
+        figname = f'time_courses_t{seconds}.png'
+        groups = sorted(self.groups)
+        parts = [seconds, self.resolution]
+        for group in groups:
+            parts += [group, list(self.data[group].columns), self.data[group].to_numpy(dtype=float)]
+        digest = figure_fingerprint(*parts)
+        if skip_unchanged and is_unchanged(self.folder, figname, digest):
+            print(f'{figname} in {self.folder} is up to date')
+            return None
         nrows = len(self.groups) + 1
         ncols = 2
-        errorevery = int(np.log10(seconds))
-        time = seconds + 1
-        fig, axes = plt.subplots(nrows, ncols, figsize=(12, (nrows * 4)))
+        errorevery = max(1, round(int(np.log10(seconds)) / self.resolution))
+        time = n_time_points(seconds, self.resolution)
+        fig, axes = new_figure(nrows, ncols, figsize=(12, (nrows * 4)))
         fig.subplots_adjust(hspace=0.3)
         fig.suptitle('Bout-time-curves of trials and groups', fontsize=15)
-        x = range(time)
-        groups = sorted(self.groups)
+        x = np.asarray(self.store.time_index()[:time], dtype=float)
 
         for ax, group in zip(axes.flatten()[:-2:2], groups):
-            mice = [trial.mouse for trial in self.trials if trial.group == group]
-            for mouse in mice:
-                y = self.data[group][mouse][:time]
-                ax.plot(x, y)
-            ax.legend(mice, loc='upper left');
+            mice = trial_columns(self.data[group])
+            curves = self.data[group][mice].to_numpy(dtype=float)[:time].T
+            add_timecourses(ax, x, curves, mice)
             ax.set(title=f'Time courses per mouse in {group}',
                    xlabel='Trial time (s)',
-                   ylabel='Cumulative bouts');
+                   ylabel='Cumulative bouts')
 
         for ax, group in zip(axes.flatten()[1:-2:2], groups):
-            y = self.data[group]['Mean'][:time]
-            yerr = self.data[group]['SD(n-1)'][:time]
+            y = self.data[group]['Mean'].iloc[:time]
+            yerr = self.data[group]['SD(n-1)'].iloc[:time]
             ax.errorbar(x, y,
                         yerr=yerr,
                         errorevery=errorevery)
-            ax.legend((group,), loc='upper left');
+            ax.legend((group,), loc='upper left')
             ax.set(title='Averaged time course curve ± SD',
                    xlabel='Trial time (s)',
-                   ylabel='Cumulative bouts');
+                   ylabel='Cumulative bouts')
 
         for group in groups:
-            y = self.data[group]['Mean'][:time]
-            yerr = self.data[group]['SD(n-1)'][:time]
+            y = self.data[group]['Mean'].iloc[:time]
+            yerr = self.data[group]['SD(n-1)'].iloc[:time]
             axes.flatten()[-2].errorbar(x, y,
                                         yerr=yerr,
                                         errorevery=errorevery)
-            axes.flatten()[-2].legend(groups, loc='upper left');
-            axes.flatten()[-2].set(title='Averaged time course curves ± SD',
-                                   xlabel='Trial time (s)',
-                                   ylabel='Cumulative bouts');
-            yerr2 = self.data[group]['SD(n-1)'][:time] / np.sqrt(self.data[group]['n'][:time])
+            yerr2 = self.data[group]['SD(n-1)'].iloc[:time] / np.sqrt(self.data[group]['n'].iloc[:time])
             axes.flatten()[-1].errorbar(x, y,
                                         yerr=yerr2,
                                         errorevery=errorevery)
-            axes.flatten()[-1].legend(groups, loc='upper left');
-            axes.flatten()[-1].set(title='Averaged time course curves ± SEM',
-                                   xlabel='Trial time (s)',
-                                   ylabel='Cumulative bouts');
-        figname = f'time_courses_t{seconds}.png'
-        fig.savefig(self.folder + '/' + figname)
+        axes.flatten()[-2].legend(groups, loc='upper left')
+        axes.flatten()[-2].set(title='Averaged time course curves ± SD',
+                               xlabel='Trial time (s)',
+                               ylabel='Cumulative bouts')
+        axes.flatten()[-1].legend(groups, loc='upper left')
+        axes.flatten()[-1].set(title='Averaged time course curves ± SEM',
+                               xlabel='Trial time (s)',
+                               ylabel='Cumulative bouts')
+        with self.profiler.stage('save figure'):
+            fig.savefig(self.folder + '/' + figname)
+        record_fingerprints(self.folder, {figname: digest})
         print(f'Saved {figname} to {self.folder}')
         return fig
 
-    def plot_results(self):
+    @profiled('plot_groups')
+    def plot_groups(self, seconds=None, workers=None, skip_unchanged=True):
+        """Saves one png file per group in TRA.folder: time courses per mouse | mean ± SD,
+        until the specified second (by default until duration). Figures are rendered in a pool
+        of that many processes if workers > 1; files saved from the same data before are skipped
+        unless skip_unchanged is False. Returns list of paths of the rendered files.
+        """
+        from .plotting import render_group_panel, figure_fingerprint, is_unchanged, record_fingerprints
+        if seconds is None:
+            seconds = self.duration
+        errorevery = max(1, round(int(np.log10(seconds)) / self.resolution))
+        time = n_time_points(seconds, self.resolution)
+        x = np.asarray(self.store.time_index()[:time], dtype=float)
+        jobs, digests = [], dict()
+        for group in sorted(self.groups):
+            figname = f'time_courses_{group}_t{seconds}.png'
+            mice = trial_columns(self.data[group])
+            df_timecourse = self.data[group].iloc[:time]
+            curves = df_timecourse[mice].to_numpy(dtype=float).T
+            mean = df_timecourse['Mean'].to_numpy(dtype=float)
+            sd = df_timecourse['SD(n-1)'].to_numpy(dtype=float)
+            digest = figure_fingerprint(group, mice, x, curves, mean, sd, errorevery)
+            if skip_unchanged and is_unchanged(self.folder, figname, digest):
+                continue
+            digests[figname] = digest
+            jobs.append((os.path.join(self.folder, figname), group, x, curves, mice, mean, sd, errorevery))
+        if workers is not None and workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                paths = list(executor.map(render_group_panel, *zip(*jobs)))
+        else:
+            paths = [render_group_panel(*job) for job in jobs]
+        if digests:
+            record_fingerprints(self.folder, digests)
+        print(f'Saved {len(paths)} group figures to {self.folder}, '
+              f'{len(self.groups) - len(paths)} up to date')
+        return paths
+
+    @profiled('plot_results')
+    def plot_results(self, skip_unchanged=False):
         """Returns an array of plots of summarized metrics:
         - total bouts
         - bouts per minute
         - idle time (no-response-time, threshold = 15 s)
         - success rate (tape riddance (success) or trial time-out)
         - averaged time courses
-        - AUC: area under the averaged time course
+        - AUC: area under the averaged time course, see 'AUC of mean curve' of TRA.auc_summary(),
+          ± SD, see TrialStore.mean_curve_auc_sd()
+        With skip_unchanged, the figure is not rendered again (returns None) if the png file
+        was saved from the same data before.
         """
         # plt array of result metric graphs
         # - total bouts means | bpm means
         # - idle time means | success rates
         # - averaged time coures | auc means
-        fig, ax = plt.subplots(nrows=3, ncols=2, figsize=(12, 12))
+        from matplotlib.patches import Patch
+        from .plotting import new_figure, add_group_metric, figure_fingerprint, is_unchanged, record_fingerprints
+        figname = f'results.png'
+        groups = sorted(self.groups)
+        parts = [list(self.metrics.columns), self.metrics.to_numpy(dtype=str), self.store.values, self.store.offsets]
+        for group in groups:
+            parts += [group, self.data[group][['Mean', 'SD(n-1)', 'n']].to_numpy(dtype=float)]
+        digest = figure_fingerprint(*parts)
+        if skip_unchanged and is_unchanged(self.folder, figname, digest):
+            print(f'{figname} in {self.folder} is up to date')
+            return None
+        fig, ax = new_figure(nrows=3, ncols=2, figsize=(12, 12))
         # fig.subplots_adjust(hspace=0.3)
         # fig.suptitle('Results of the Tape Response Assay', fontsize=15)
         colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                   '#bcbd22', '#17becf']
+        colors = [colors[i % len(colors)] for i in range(len(groups))]
         alpha = 0.7
         capsize = 10
-        groups = sorted(self.groups)
         x = [i for i in range(len(groups))]  # for plotting groups on all x-axes
+        codes = pd.Categorical(self.metrics['Group'], categories=groups).codes
 
-        # Total Bouts
-        for i in x:
-            y = self.metrics[self.metrics['Group'] == groups[i]]['Total bouts']
-            y_mean = np.mean(y)
-            y_sem = stats.sem(y)
-            x_jitter = np.random.normal(i, 0.09, size=len(y))
-            ax[0, 0].scatter(x_jitter, y, c=colors[i], alpha=alpha)
-            ax[0, 0].bar(i, y_mean, yerr=y_sem, facecolor=colors[i], capsize=capsize, alpha=alpha)
-        ax[0, 0].set(xticks=x, xticklabels=groups,
-                     title='Total bouts, mean ± SEM',
-                     ylabel='Total bouts')
-
-        # Bouts per minute
-        for i in x:
-            y = self.metrics[self.metrics['Group'] == groups[i]]['Bouts per minute']
-            y_mean = np.mean(y)
-            y_sem = stats.sem(y)
-            x_jitter = np.random.normal(i, 0.09, size=len(y))
-            ax[0, 1].scatter(x_jitter, y, c=colors[i], alpha=alpha)
-            ax[0, 1].bar(i, y_mean, yerr=y_sem, facecolor=colors[i], capsize=capsize, alpha=alpha)
-        ax[0, 1].set(xticks=x, xticklabels=groups,
-                     title='Bouts per minute, mean ± SEM',
-                     ylabel='Bouts per minute')
-
-        # Idle time
-        for i in x:
-            y = self.metrics[self.metrics['Group'] == groups[i]]['Idle time']
-            y_mean = np.mean(y)
-            y_sem = stats.sem(y)
-            x_jitter = np.random.normal(i, 0.09, size=len(y))
-            ax[1, 0].scatter(x_jitter, y, c=colors[i], alpha=alpha)
-            ax[1, 0].bar(i, y_mean, yerr=y_sem, facecolor=colors[i], capsize=capsize, alpha=alpha)
-        ax[1, 0].set(xticks=x, xticklabels=groups,
-                     title='Idle time, mean ± SEM',
-                     ylabel='Idle time')
+        # Total Bouts | Bouts per minute | Idle time
+        for axis, column, title in ((ax[0, 0], 'Total bouts', 'Total bouts, mean ± SEM'),
+                                    (ax[0, 1], 'Bouts per minute', 'Bouts per minute, mean ± SEM'),
+                                    (ax[1, 0], 'Idle time', 'Idle time, mean ± SEM')):
+            add_group_metric(axis, self.metrics[column], codes, groups, colors, title, column,
+                             alpha=alpha, capsize=capsize)
 
         # Success rate
-        legend_elements = []
-        for i in x:
-            successes = self.metrics[self.metrics['Group'] == groups[i]]['Success']
-            success_rate = sum(successes) / len(successes)
-            ax[1, 1].bar(i, success_rate, color=colors[i], alpha=alpha, label=groups[i])
-            ax[1, 1].bar(i, 1-success_rate, bottom=success_rate, color='gray', alpha=alpha)
-        legend_elements.append(Patch(facecolor='white', alpha=alpha, label='success'))
-        legend_elements.append(Patch(facecolor='gray', alpha=alpha, label='time-out'))
+        success_rate = np.bincount(codes, weights=self.metrics['Success'].to_numpy(dtype=float),
+                                   minlength=len(groups)) / np.bincount(codes, minlength=len(groups))
+        ax[1, 1].bar(x, success_rate, color=colors, alpha=alpha)
+        ax[1, 1].bar(x, 1 - success_rate, bottom=success_rate, color='gray', alpha=alpha)
+        legend_elements = [Patch(facecolor='white', alpha=alpha, label='success'),
+                           Patch(facecolor='gray', alpha=alpha, label='time-out')]
         ax[1, 1].legend(handles=legend_elements, bbox_to_anchor=(1, 1), loc='upper right',
            ncol=1)
         ax[1, 1].set(xticks=x, xticklabels=groups,
@@ -199,55 +502,191 @@ class TRA:
         for i in x:
             y = self.data[groups[i]]['Mean']
             y_sem = self.data[groups[i]]['SD(n-1)'] / np.sqrt(self.data[groups[i]]['n'])
-            xs = range(len(y))
+            xs = y.index
             ax[2, 0].errorbar(xs, y, alpha=alpha,
                               yerr=y_sem,
                               errorevery=3)
-            ax[2, 0].legend(groups, loc='upper left')
-            ax[2, 0].set(title='Averaged time course curve ± SEM',
-                         xlabel='Trial time (s)',
-                         ylabel='Cumulative bouts')
+        ax[2, 0].legend(groups, loc='upper left')
+        ax[2, 0].set(title='Averaged time course curve ± SEM',
+                     xlabel='Trial time (s)',
+                     ylabel='Cumulative bouts')
 
         # Area under the averaged time course
+        auc_groups = self.auc_summary()[1]
+        sd_groups = pd.Series(self.store.mean_curve_auc_sd(), index=self.store.group.categories)
         for i in x:
-            means_auc, vars_auc, ns = [], [], []
-            for sec in range(0, 300):
-                sec_sum = []
-                for trial in self.trials:
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore", category=RuntimeWarning)
-                        if trial.group == groups[i]:
-                            sec_sum.append(trial.auctimecourse300[sec])
-                means_auc.append(np.nanmean(sec_sum))
-                vars_auc.append(np.nanvar(sec_sum, ddof=1))
-                ns.append(np.count_nonzero(~np.isnan(sec_sum)))
-            mean_auc = np.nansum(means_auc)
-            sd_auc = math.sqrt(np.nansum(vars_auc))
-            n_auc = np.max(ns)
+            n_auc = auc_groups.at[groups[i], 'n']
+            mean_auc = auc_groups.at[groups[i], 'AUC of mean curve']
+            sd_auc = sd_groups[groups[i]]
             print(f'AUC {groups[i]}: n = {n_auc}, {mean_auc} ± {sd_auc} (SD)')
-            ax[2, 1].bar(i, mean_auc, yerr=sd_auc, facecolor=colors[i], capsize=capsize, alpha=alpha, label=groups[i])
-            ax[2, 1].set(xticks=x, xticklabels=groups,
-                         title='Area under the averaged time curve ± SD',
-                         ylabel='AUC (cumulative bouts * seconds)')
+        ax[2, 1].bar(x, auc_groups.loc[groups, 'AUC of mean curve'], yerr=sd_groups[groups],
+                     color=colors, capsize=capsize, alpha=alpha)
+        ax[2, 1].set(xticks=x, xticklabels=groups,
+                     title='Area under the averaged time curve ± SD',
+                     ylabel='AUC (cumulative bouts * seconds)')
 
         for ax in ax.flatten():
             for tick in ax.get_xticklabels():
                 tick.set_rotation(45)
-        plt.tight_layout()
-        figname = f'results.png'
-        fig.savefig(self.folder + '/' + figname)
+        fig.tight_layout()
+        with self.profiler.stage('save figure'):
+            fig.savefig(self.folder + '/' + figname)
+        record_fingerprints(self.folder, {figname: digest})
         print(f'Saved {figname} to {self.folder}')
         return fig
 
+    @profiled('auc_summary')
+    def auc_summary(self):
+        """Returns two DataFrames of the exact area under the cumulative bout curve (AUC),
+        computed in closed form from the step function of bout times for all trials at once:
+        - per trial: Group, Mouse, Date and AUC from 0 until trial end
+        - per group: n, Mean, SD(n-1) and SEM of the trials' AUC
+          and the AUC of the averaged time course curve (see TrialStore.mean_curve_auc())
+        """
+        store = self.store
+        auc = store.step_auc()
+        df_trials = pd.DataFrame({
+            'Group': np.asarray(store.group),
+            'Mouse': np.asarray(store.mouse),
+            'Date': np.asarray(store.date),
+            'AUC': auc
+        })
+        codes = store.group.codes
+        n = np.bincount(codes, minlength=len(store.group.categories))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.bincount(codes, weights=auc, minlength=len(n)) / n
+            sd = np.sqrt(np.bincount(codes, weights=(auc - mean[codes]) ** 2, minlength=len(n)) / (n - 1))
+        sd[n < 2] = np.nan
+        df_groups = pd.DataFrame({
+            'n': n,
+            'Mean': mean,
+            'SD(n-1)': sd,
+            'SEM': sd / np.sqrt(n),
+            'AUC of mean curve': store.mean_curve_auc()
+        }, index=pd.Index(store.group.categories, name='Group'))
+        return df_trials, df_groups[n > 0]
+
+    @profiled('idle_time_sweep')
+    def idle_time_sweep(self, thresholds=range(5, 65, 5)):
+        """Returns two DataFrames (trials x idle thresholds in seconds) of idle time and of the number of
+        idle periods, i.e. inter-bout intervals longer than the threshold, for all thresholds at once.
+        Rows are in order of TRA.metrics; the 15 s column of idle time equals its 'Idle time'.
+        """
+        thresholds = list(thresholds)
+        idle_time, idle_periods = self.store.idle_time_sweep(thresholds)
+        columns = pd.Index(thresholds, name='Idle threshold (s)')
+        return (pd.DataFrame(idle_time, index=self.metrics.index, columns=columns),
+                pd.DataFrame(idle_periods, index=self.metrics.index, columns=columns))
+
+    @profiled('ibi_distribution')
+    def ibi_distribution(self):
+        """Returns DataFrame of all inter-bout intervals (time between consecutive bouts in seconds)
+        with Group, Mouse and Date of their trial, e.g. for histograms per group.
+        """
+        store = self.store
+        intervals, index = store.bout_intervals()
+        return pd.DataFrame({
+            'Group': np.asarray(store.group)[index],
+            'Mouse': np.asarray(store.mouse)[index],
+            'Date': np.asarray(store.date)[index],
+            'Inter-bout interval': intervals
+        })
+
+    @profiled('bout_rates')
+    def bout_rates(self, seconds=30, rolling=False):
+        """Returns bout rates (bouts per minute) in consecutive time bins of the specified length in seconds
+        or, if rolling, in windows of that length ending at every time point:
+        - DataFrame per trial: Group, Mouse, Date and one column per window end time (s)
+        - Dictionary of group : DataFrame of Mean, SD(n-1), SEM and n per window end time (s)
+        Derived from the cumulative time courses of all trials at once (see TrialStore.bout_rates())
+        and cached in TRA.rates, where plot_rates() and to_excel() take them from.
+        """
+        key = (seconds, rolling)
+        if key in self.rates:
+            return self.rates[key]
+        store = self.store
+        rates, times = store.bout_rates(seconds, rolling)
+        df_rates = pd.DataFrame(rates, columns=times.round(9))
+        df_rates.insert(0, 'Group', np.asarray(store.group))
+        df_rates.insert(1, 'Mouse', np.asarray(store.mouse))
+        df_rates.insert(2, 'Date', np.asarray(store.date))
+        mean, sd, n = matrix_group_statistics(rates, store.group.codes, len(store.group.categories))
+        rates_groups = dict()
+        for code, group in enumerate(store.group.categories):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sem = sd[code] / np.sqrt(n[code])
+            rates_groups[group] = pd.DataFrame({'Mean': mean[code], 'SD(n-1)': sd[code], 'SEM': sem, 'n': n[code]},
+                                               index=pd.Index(times.round(9), name='Time (s)'))
+        self.rates[key] = (df_rates, rates_groups)
+        return self.rates[key]
+
+    @profiled('plot_rates')
+    def plot_rates(self, seconds=30, rolling=False):
+        """Returns plot of bout rates per group, mean ± SEM, see .bout_rates(),
+        and saves it in TRA.folder as png file.
+        """
+        from .plotting import new_figure
+        rates_groups = self.bout_rates(seconds, rolling)[1]
+        groups = sorted(self.groups)
+        kind = 'rolling' if rolling else 'bins'
+        fig, axes = new_figure(figsize=(12, 6))
+        ax = axes[0, 0]
+        for group in groups:
+            y = rates_groups[group]['Mean']
+            ax.errorbar(y.index, y, yerr=rates_groups[group]['SEM'], capsize=3)
+        ax.legend(groups, loc='upper right')
+        ax.set(title=f'Bout rates ({seconds} s {kind}), mean ± SEM',
+               xlabel='Trial time (s)',
+               ylabel='Bouts per minute')
+        figname = f'bout_rates_{seconds}s_{kind}.png'
+        with self.profiler.stage('save figure'):
+            fig.savefig(self.folder + '/' + figname)
+        print(f'Saved {figname} to {self.folder}')
+        return fig
+
+    @profiled('metric_statistics')
+    def metric_statistics(self, resamples=10000, confidence=0.95, control=None, seed=0, workers=None, chunk=None):
+        """Returns two tidy DataFrames of resampling statistics of every metric in TRA.metrics
+        (Success as fraction of successful trials), see resampling.resampling_statistics():
+        - per Metric and Group: n, Mean and bootstrap confidence interval (CI low, CI high) of the mean
+        - per Metric and pair of groups (or every group against control): Difference of means (Group B - Group A),
+          its bootstrap confidence interval, Cohen's d and the two-sided permutation p-value
+        Resamples are drawn as batched index arrays in chunks of bounded size (resamples per chunk),
+        optionally in workers processes; the same seed gives the same results.
+        """
+        columns = [column for column in self.metrics.columns if column not in ('Group', 'Mouse', 'Date')]
+        matrix = self.metrics[columns].to_numpy(dtype=float)
+        return resampling_statistics(matrix, self.store.group.codes, self.store.group.categories,
+                                     {'Metric': columns}, resamples, confidence, control, seed, workers, chunk)
+
+    @profiled('timecourse_statistics')
+    def timecourse_statistics(self, seconds=10, resamples=10000, confidence=0.95, control=None, seed=0,
+                              workers=None, chunk=None):
+        """Returns two tidy DataFrames as .metric_statistics(), of the cumulative bouts of the time courses
+        at every specified second (one row per Time (s) and group or pair of groups) instead of metrics.
+        Time courses end with their trial, so later time points only count trials still running.
+        Bouts are only counted at those time points, see TrialStore.timecourses_at().
+        """
+        steps = max(1, int(round(seconds / self.resolution)))
+        times = self.store.time_index()
+        points = np.arange(steps, len(times), steps)
+        matrix = self.store.timecourses_at(points)
+        return resampling_statistics(matrix, self.store.group.codes, self.store.group.categories,
+                                     {'Time (s)': times[points]}, resamples, confidence, control, seed,
+                                     workers, chunk)
+
+    @profiled('to_excel')
     def to_excel(self):
         """Crawls folder for txt files; instantiates them as Trial() objects,
         thereby analyzing various tape assay metrics;
         prints these metrics to 'TapeResponseAssay.xlsx'.
-        Creates worksheets for all metrics and timecourse per group, respectively.
+        Creates worksheets for all metrics and timecourse per group, respectively,
+        and for bout rates already computed with .bout_rates().
         """
         outputfile = os.path.join(self.folder, 'TapeResponseAssay.xlsx')
         writer = pd.ExcelWriter(outputfile, engine='xlsxwriter')
         groups = sorted(self.groups)
+        sheet_names = set()
         # Write each dataframe (all metrics, group timecourse) to a different worksheet.
 
         df_metrics = self.metrics
@@ -257,59 +696,48 @@ class TRA:
         for group in groups:
             df_timecourse = self.data[group]
             df_timecourse.to_excel(writer,
-                                   sheet_name=str(group) + '_Time courses',
+                                   sheet_name=excel_sheet_name(group, '_Time courses', sheet_names),
                                    index=True)
             sys.stdout.write(
                 f'Writing sheet for time courses of group "{group}" to excel file.\n')
 
-        writer.save()
+        for (seconds, rolling), (df_rates, rates_groups) in self.rates.items():
+            kind = 'rolling' if rolling else 'bins'
+            df_rates.to_excel(writer, sheet_name=excel_sheet_name('Bout rates', f' {seconds}s {kind}', sheet_names),
+                              index=False)
+            for group in groups:
+                rates_groups[group].to_excel(writer,
+                                             sheet_name=excel_sheet_name(group, f'_Rates {seconds}s {kind}', sheet_names),
+                                             index=True)
+            sys.stdout.write(f'Writing sheets for bout rates ({seconds} s {kind}) to excel file.\n')
+
+        writer.close()
         sys.stdout.write(f'All done; see {outputfile}')
 
 
+def excel_sheet_name(name, suffix, used):
+    """Returns a valid, unique excel sheet name of name + suffix: characters excel does not allow are replaced,
+    name is shortened to keep the suffix within 31 characters, and a number is appended if the sheet
+    name is already in the set used (compared case-insensitively, like excel), which it is added to.
+    """
+    name = ''.join('_' if character in SHEET_NAME_FORBIDDEN else character for character in str(name))
+    suffix = ''.join('_' if character in SHEET_NAME_FORBIDDEN else character for character in suffix)
+    sheet_name = (name[:max(0, SHEET_NAME_LENGTH - len(suffix))] + suffix)[:SHEET_NAME_LENGTH]
+    number = 1
+    while sheet_name.lower() in used:
+        number += 1
+        tag = f'~{number}'
+        sheet_name = (name[:max(0, SHEET_NAME_LENGTH - len(suffix) - len(tag))] + tag + suffix)[:SHEET_NAME_LENGTH]
+    used.add(sheet_name.lower())
+    return sheet_name
+
+
 def trials_to_df(trials):
-    """Returns DataFrame of trial metrics."""
-    group, mouse, date, success, total_bouts, total_time, idle_time, bpm, auc = [], [], [], [], [], [], [], [], []
-
-    for trial in trials:
-        group.append(trial.group)
-        mouse.append(trial.mouse)
-        date.append(trial.date)
-        success.append(trial.success)
-        total_bouts.append(trial.total_bouts)
-        total_time.append(trial.total_time)
-        idle_time.append(trial.idle_time)
-        bpm.append(trial.bouts_per_minute)
-        auc.append(trial.auc)
-
-    df_metrics = pd.DataFrame({
-        'Group': group,
-        'Mouse': mouse,
-        'Date': date,
-        'Success': success,
-        'Total bouts': total_bouts,
-        'Total time': total_time,
-        'Idle time': idle_time,
-        'Bouts per minute': bpm,
-        'AUC (Area under the trial time course curve)': auc
-    })
-
-    return df_metrics
+    """Returns DataFrame of trial metrics, for the duration and resolution the trials were made with."""
+    duration, resolution = (trials[0].duration, trials[0].resolution) if trials else (DURATION, 1)
+    return TrialStore.from_trials(trials, duration, resolution).metrics()
 
 
 def timecourses_to_dfs(experiment):
-    tc_groups = dict()
-    for group in experiment.groups:
-        df_timecourse = pd.DataFrame({trial.mouse: trial.timecourse300 for trial in experiment.trials
-                                      if trial.group == group})
-        df_timecourse['Mean'] = df_timecourse[[trial.mouse for trial in experiment.trials
-                                               if trial.group == group]].mean(axis=1)
-        df_timecourse['SD(n-1)'] = df_timecourse[[trial.mouse for trial in experiment.trials
-                                                  if trial.group == group]].std(axis=1, ddof=1)
-        df_timecourse['n'] = df_timecourse[[trial.mouse for trial in experiment.trials
-                                            if trial.group == group]].count(axis=1)
-        cols = df_timecourse.columns.tolist()
-        cols = cols[-3:] + cols[:-3]
-        df_timecourse = df_timecourse[cols]
-        tc_groups[group] = df_timecourse
-
-    return tc_groups
+    """Returns dictionary of group : DataFrame of time courses per mouse and their Mean, SD(n-1) and n."""
+    return experiment.store.group_timecourses()
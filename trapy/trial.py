@@ -1,60 +1,92 @@
 import ntpath
-import pandas as pd
 import numpy as np
-from sklearn import metrics
-import math
+from .parser import read_boutlists, parse_boutlists, DURATION
+from .timecourse import timecourse_matrix, trial_ends
+
+
+# names of the metrics attributes of Trial
+METRICS = ('idle_time', 'total_bouts', 'total_time', 'bouts_per_minute', 'success', 'auc', 'tibi',
+           'timecourse300', 'timecourse', 'auctimecourse300')
+
+
+class lazy_metric:
+    """Descriptor of a Trial metric: computed from the trial on first access and cached in slot '_<name>'.
+    Time courses are stored as NumPy arrays.
+    """
+    def __init__(self, compute):
+        self.compute = compute
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def __get__(self, trial, owner=None):
+        if trial is None:
+            return self
+        try:
+            return getattr(trial, self.slot)
+        except AttributeError:
+            value = self.compute(trial)
+            if isinstance(value, list):
+                value = np.asarray(value)
+            setattr(trial, self.slot, value)
+            return value
+
+    def __set__(self, trial, value):
+        setattr(trial, self.slot, value)
 
 
 class Trial:
-    """Class to hold all relevant info of a single tape response assay trial."""
-    def __init__(self, path_to_file):
+    """Class to hold all relevant info of a single tape response assay trial.
+    The boutlist is held as NumPy array; metrics are computed on first access and then cached.
+    Maximal trial time (duration) and time between time points of time courses (resolution) are in seconds.
+    An already parsed boutlist (e.g. from parser.read_boutlists()) can be passed to skip reading the file.
+    """
+    __slots__ = ('path_to_file', 'trial_name', 'date', 'mouse', 'group', 'boutlist', 'duration', 'resolution') + \
+        tuple('_' + name for name in METRICS)
+
+    def __init__(self, path_to_file, boutlist=None, duration=DURATION, resolution=1):
         self.path_to_file = path_to_file
-        self.trial_name = ntpath.basename(path_to_file)
-        self.date = self.trial_name[:6]
-        self.mouse = self.trial_name[6:8]
-        self.group = self.trial_name[8:-4]
-        self.boutlist = create_boutlist(self.path_to_file)
-        self.idle_time = idle_time(self.boutlist)
-        self.total_bouts = total_bouts(self.boutlist)
-        self.total_time = total_time(self.boutlist)
-        self.bouts_per_minute = bouts_per_minute(self.boutlist)
-        self.success = trial_success(self.boutlist)
-        self.auc = area_under_the_curve(self.boutlist)
-        self.tibi = tape_induced_behaviour_index(self.boutlist)
-        self.timecourse300 = bout_time_curve_300(self.boutlist)
-        self.timecourse = bout_time_curve(self.boutlist)
-        self.auctimecourse300 = auc_time_curve300(self.timecourse300)
-
-
-def create_boutlist(path_to_file):
+        self.trial_name, self.date, self.mouse, self.group = parse_trial_name(path_to_file)
+        self.duration = duration
+        self.resolution = resolution
+        if boutlist is None:
+            boutlist = create_boutlist(self.path_to_file, self.duration)
+        self.boutlist = np.asarray(boutlist, dtype=float)
+
+    idle_time = lazy_metric(lambda trial: idle_time(trial.boutlist.tolist()))
+    total_bouts = lazy_metric(lambda trial: total_bouts(trial.boutlist.tolist(), trial.duration))
+    total_time = lazy_metric(lambda trial: total_time(trial.boutlist.tolist()))
+    bouts_per_minute = lazy_metric(lambda trial: bouts_per_minute(trial.boutlist.tolist(), trial.duration))
+    success = lazy_metric(lambda trial: trial_success(trial.boutlist.tolist(), trial.duration))
+    auc = lazy_metric(lambda trial: area_under_the_curve(trial.boutlist.tolist()))
+    tibi = lazy_metric(lambda trial: tape_induced_behaviour_index(trial.boutlist.tolist(), trial.duration))
+    timecourse300 = lazy_metric(lambda trial: bout_time_curve_300(trial.boutlist, trial.duration, trial.resolution))
+    timecourse = lazy_metric(lambda trial: bout_time_curve(trial.boutlist, trial.duration, trial.resolution))
+    auctimecourse300 = lazy_metric(lambda trial: auc_time_curve300(trial.timecourse300, trial.resolution))
+
+
+def parse_trial_name(path_to_file):
+    """Takes path to a txt file named "yymmddaa*g.txt", returns (file name, date yymmdd, mouse aa, group *g)."""
+    trial_name = ntpath.basename(path_to_file)
+    return trial_name, trial_name[:6], trial_name[6:8], trial_name[8:-4]
+
+
+def is_trial_file(filename):
+    """Returns whether a file name is one of a txt file of the timer app, i.e. ends with '.txt'."""
+    return filename.endswith('.txt')
+
+
+def create_boutlist(path_to_file, duration=DURATION):
     """Converts csv ouput of timer app to a list of times of bouts in seconds; 
-    300 is added at the end if mouse did not get tape off in time.
+    duration (300) is added at the end if mouse did not get tape off in time.
+    Takes a path or a binary file-like object (e.g. an archive member or upload).
+    See parser.read_boutlists() to convert many files at once, sources.py for archives.
     """
-    df = pd.read_csv(path_to_file, sep=" ", header=None)
-    boutlist = []
-    bouts_after_300s = 0  # bouts after 5 minute trial time are not relevant for statistics
-
-    for index, row in df.iterrows():
-        hours = int(row[1].replace('h', ''))
-        minutes = int(row[2].replace('m', ''))
-        seconds = int(row[3].replace('s', ''))
-        milliseconds = float(int(row[4].replace('ms', '')))  # milliseconds are given as 1 second / 100 here
-        seconds_total = hours * 3600 + minutes * 60 + seconds + milliseconds * 0.01
-
-        if seconds_total < 300:
-            boutlist.append(seconds_total)  # len(boutlist) is total bout count now
-        else:
-            bouts_after_300s += 1
-
-    if bouts_after_300s > 0:
-        boutlist.append(300)
-
-        # len(boutlist)-1 is total bout count for full trials now, 
-    # the 300 in the end signifies that mouse didn't get tape off in time
     # keep in mind that 'full trials' (5 min, no 'success') have total bouts
     # of len(boutlist)-1, while successful trials have len(boutlist) total bouts!!
-
-    return boutlist
+    if hasattr(path_to_file, 'read'):
+        return parse_boutlists([path_to_file.read()], duration)[0].tolist()
+    return read_boutlists([path_to_file], duration)[0].tolist()
 
 
 def idle_time(boutlist, idle_threshold=15):
@@ -69,11 +101,11 @@ def idle_time(boutlist, idle_threshold=15):
     return idle_time
 
 
-def total_bouts(boutlist):
+def total_bouts(boutlist, duration=DURATION):
     """Takes list of times of bouts in seconds, returns number of total tape-directed bouts performed.
-    Takes into account, that a 300 at the end signifies a full trial (ending time), not an actual bout.
+    Takes into account, that a duration (300) at the end signifies a full trial (ending time), not an actual bout.
     """
-    if boutlist[-1] == 300:
+    if boutlist[-1] == duration:
         total_bouts = len(boutlist) - 1
     else:
         total_bouts = len(boutlist)
@@ -86,25 +118,26 @@ def total_time(boutlist):
     return total_time
 
 
-def bouts_per_minute(boutlist):
+def bouts_per_minute(boutlist, duration=DURATION):
     """Takes list of times of bouts in seconds, returns bpm = total_bouts / total_time."""
-    bpm = (total_bouts(boutlist) / total_time(boutlist)) * 60
+    bpm = (total_bouts(boutlist, duration) / total_time(boutlist)) * 60
     return bpm
 
 
-def tape_induced_behaviour_index(boutlist):
-    """Takes list of times of bouts in seconds, returns tibi = BPM * (5 - idle_time / 60).
+def tape_induced_behaviour_index(boutlist, duration=DURATION):
+    """Takes list of times of bouts in seconds, returns tibi = BPM * (5 - idle_time / 60),
+    with 5 being the maximal trial time (duration) in minutes.
     This measure is supposed to unite activity, inactivity and success in one KPI.
     """
-    tibi = bouts_per_minute(boutlist) * (5 - idle_time(boutlist) / 60)
+    tibi = bouts_per_minute(boutlist, duration) * (duration / 60 - idle_time(boutlist) / 60)
     return tibi
 
 
-def trial_success(boutlist):
+def trial_success(boutlist, duration=DURATION):
     """Takes list of times of bouts in seconds, 
     returns bool of whether the mouse managed to get the tape off in time.
     """
-    if boutlist[-1] == 300:
+    if boutlist[-1] == duration:
         success = False
     else:
         success = True
@@ -112,49 +145,36 @@ def trial_success(boutlist):
 
 
 def area_under_the_curve(boutlist):
-    """Takes list of times of bouts in seconds, returns the area under the curve. Utilises the trapezoidal rule."""
-    auc = metrics.auc(boutlist, range(0, len(boutlist)))
+    """Takes list of times of bouts in seconds, returns the area under the curve. Utilises the trapezoidal rule
+    over bout times (x) and bout numbers (y = 0, 1, ...): sum of interval * (number of bouts before + 0.5).
+    """
+    bout_numbers = np.arange(len(boutlist))
+    auc = (np.diff(np.asarray(boutlist, dtype=float)) * (bout_numbers[1:] + bout_numbers[:-1]) / 2).sum()
     return auc
 
 
-def bout_time_curve_300(boutlist):
-    """Takes list of times of bouts in seconds, converts it to list of bout counts per second over 300 seconds.
-    Returned list will always have 301 items, that can be NaN if trial has ended before the 300 second mark.
+def bout_time_curve_300(boutlist, duration=DURATION, resolution=1):
+    """Takes list of times of bouts in seconds, converts it to list of bout counts per second over 300 seconds
+    (per resolution over duration, in seconds). Returned list will always have 301 items
+    (see timecourse.time_grid()), that can be NaN if trial has ended before the 300 second mark.
+    See timecourse.timecourse_matrix() to convert many boutlists at once.
     """
-    timecourse = []
-    for i in range(0, 301):
-        if i < math.ceil(boutlist[-1]) + 1:
-            counter = 0
-            for time in boutlist:
-                if time <= i:
-                    counter += 1
-        else:
-            counter = np.nan
-
-        timecourse.append(counter)
-    return timecourse
+    return timecourse_matrix(boutlist, [0, len(boutlist)], duration, resolution)[0].tolist()
 
 
-def bout_time_curve(boutlist):
+def bout_time_curve(boutlist, duration=DURATION, resolution=1):
     """Takes list of times of bouts in seconds,
-    converts it to list of bout counts per second over trial time in seconds.
+    converts it to list of bout counts per second (per resolution) over trial time in seconds.
+    """
+    offsets = [0, len(boutlist)]
+    curve = timecourse_matrix(boutlist, offsets, duration, resolution, count_sentinel=False)[0]
+    trial_end = trial_ends(boutlist, offsets, duration, resolution)[0]
+    return curve[:trial_end + 1].astype(int).tolist()
+
+
+def auc_time_curve300(timecourse300, resolution=1):
+    """Takes list of bout counts per second (per resolution),
+    returns list of areas under the curve per second (per resolution); trapezoidal rule.
     """
-    timecourse = []
-    for i in range(0, math.ceil(boutlist[-1]) + 1):
-        counter = 0
-        for time in boutlist:
-            if time <= i:
-                counter += 1
-            if counter > total_bouts(boutlist):
-                counter = np.nan
-        if i == 300:
-            counter = total_bouts(boutlist)
-        timecourse.append(counter)
-    return timecourse
-
-def auc_time_curve300(timecourse300):
-    l = []
-    for i in range(1,len(timecourse300), 1):
-        ys = [timecourse300[i-1], timecourse300[i]]
-        l.append(0.5 * np.sum(ys))  # trapezoidal rule
-    return l
+    timecourse300 = np.asarray(timecourse300, dtype=float)
+    return (0.5 * (timecourse300[:-1] + timecourse300[1:]) * resolution).tolist()